@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# This is a benchmark suite for mapColor's PyMol-free core, run on synthetic mapstructure tables.
+# Note: 	Every case colors a synthetic table through a RecordingBackend (so no PyMol install is needed), starting from
+#			empty value/ramp caches. Wall time, peak memory (traced Python/NumPy allocations) and PyMol API call counts are
+#			reported per case and compared against a baseline file; cases that got slower, bigger or chattier than the
+#			baseline (beyond the tolerance) are flagged.
+# Usage: 	python benchmarks/benchColor.py
+#			python benchmarks/benchColor.py --sizes 100,1000 --cases raw,log2.palette
+#			python benchmarks/benchColor.py --update		(rewrite the baseline with the current results)
+
+from __future__ import print_function
+import os, sys, json, time, random, shutil, tempfile, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mapColor
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+""" define default benchmark settings """
+benchSizes = [100, 1000, 10000, 100000]
+baselineFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+""" define the benchmark cases: every mode with and without IDs/altColor/select, and the bulk paint modes... """
+def benchCases():
+	cases = list()
+	for mode in ["raw", "normalize", "log2", "log10"]:
+		options = { "mode": mode, "target": "ratio" if mode.startswith("log") else "value", "color": "samba.color" }
+		cases.append((mode, dict(options)))
+		cases.append((mode + ".IDs", dict(options, IDs="reference")))
+		cases.append((mode + ".select", dict(options, select="2RD0,A", adjust=1)))
+		cases.append((mode + ".altColor", dict(options, altColor={ 0.0: [1, 0, 0, 1], 1.0: [0, 0, 1, 1] })))
+		cases.append((mode + ".palette", dict(options, paint="palette")))
+		cases.append((mode + ".spectrum", dict(options, paint="spectrum")))
+	return cases
+
+
+""" define a function to write a synthetic mapstructure table... """
+def writeTable(outfile, size, seed=0):
+	generator = random.Random(seed)
+	outhandle = open(outfile, "w")
+	print("\t".join(["position", "reference", "value", "ratio"]), file=outhandle)
+	for position in range(1, size + 1):
+		value = "NA" if position % 50 == 0 else repr(round(generator.uniform(-2, 3), 1) if position % 7 == 0 else generator.uniform(-2, 3))
+		ratio = repr(generator.lognormvariate(0, 1))
+		print("\t".join([str(position), generator.choice("ACDEFGHIKLMNPQRSTVWY"), value, ratio]), file=outhandle)
+	outhandle.close()
+
+
+""" define a function to run a benchmark case once, returning its wall time, peak memory and call counts... """
+def runCase(infile, options, trace=False):
+	mapColor.valueCache.clear()
+	mapColor.rampCache.clear()
+	backend = mapColor.RecordingBackend(keep="OFF")
+	stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+	try:
+		if trace:
+			tracemalloc.start()
+		start = time.time()
+		mapColor.mapColor(infile, backend=backend, **options)
+		seconds = time.time() - start
+		peak = tracemalloc.get_traced_memory()[1] if trace else None
+	finally:
+		if trace:
+			tracemalloc.stop()
+		sys.stdout.close()
+		sys.stdout = stdout
+	return seconds, peak, dict(backend.counts)
+
+
+""" define a function to compare a result against its baseline... """
+def checkResult(result, baseline, tolerance=0.5, floor=0.01):
+	flags = list()
+	if baseline is None:
+		return ["new"]
+	if result["seconds"] > baseline["seconds"] * (1 + tolerance) and result["seconds"] - baseline["seconds"] > floor:
+		flags.append("time")
+	if result["peak"] is not None and baseline.get("peak") and result["peak"] > baseline["peak"] * (1 + tolerance):
+		flags.append("memory")
+	if sum(result["calls"].values()) > sum(baseline["calls"].values()):
+		flags.append("calls")
+	return flags
+
+
+""" define the benchmark runner... """
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Benchmark mapColor on synthetic tables through a recording backend.")
+	parser.add_argument("--sizes", default=",".join(map(str, benchSizes)), help="Comma-separated residue counts.")
+	parser.add_argument("--cases", default="ALL", help="Comma-separated case names (see the table for names).")
+	parser.add_argument("--repeat", type=int, default=1, help="Timed runs per case; the best one is kept.")
+	parser.add_argument("--baseline", default=baselineFile, help="Baseline file to compare against (or write with --update).")
+	parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed relative increase over the baseline.")
+	parser.add_argument("--update", action="store_true", help="Write the results as the new baseline.")
+	options = parser.parse_args(arguments)
+
+	sizes = [ int(size) for size in options.sizes.split(",") ]
+	cases = [ case for case in benchCases() if options.cases == "ALL" or case[0] in options.cases.split(",") ]
+	baseline = json.load(open(options.baseline)) if os.path.isfile(options.baseline) else dict()
+
+	tempdir = tempfile.mkdtemp(prefix="benchColor.")
+	results, regressions = dict(), list()
+	print("\t".join(["case", "size", "seconds", "peak.MB", "calls", "flags"]))
+	try:
+		for size in sizes:
+			infile = os.path.join(tempdir, "mapstructure_%s.txt" % size)
+			writeTable(infile, size)
+			for name, caseOptions in cases:
+				key = "%s|%s" % (name, size)
+				runs = [ runCase(infile, caseOptions) for repeat in range(0, options.repeat) ]
+				seconds, calls = min([ run[0] for run in runs ]), runs[0][2]
+				peak = runCase(infile, caseOptions, trace=True)[1] if tracemalloc is not None else None
+				results[key] = { "seconds": round(seconds, 5), "peak": peak, "calls": calls }
+				flags = checkResult(results[key], baseline.get(key), tolerance=options.tolerance)
+				if [ flag for flag in flags if flag != "new" ]:
+					regressions.append(key)
+				peakMB = "NA" if peak is None else "%.2f" % (peak / 1e6)
+				print("\t".join([name, str(size), "%.4f" % seconds, peakMB, str(sum(calls.values())), ",".join(flags)]))
+				sys.stdout.flush()
+	finally:
+		shutil.rmtree(tempdir)
+
+	if options.update:
+		baseline.update(results)
+		json.dump(baseline, open(options.baseline, "w"), indent=1, sort_keys=True)
+		print("Baseline written:", options.baseline)
+	elif regressions:
+		print("Regressions:", ", ".join(regressions))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# This is a command-line script that colors and renders many mapColor jobs with a pool of headless PyMol workers.
+# Note: 	Jobs are read from a manifest (CSV, tab-delimited or JSON), one job per row/object, with the mapColor options
+#			as columns/keys plus the following:
+#
+#			infile		:	Path to value input file (mapvariant_*.txt, mapstructure_*.txt, ...).
+#			structure	:	PDB file or PDB ID to load (jobs sharing a structure and setup reuse the loaded object).
+#			save		:	Output image (PNG).
+#			setup		:	PyMol commands to run after loading the structure (e.g. "hide everything; show cartoon").
+#			name		:	Job name used in the report (defaults to the output image).
+#
+#			Movie frames colored by mapColor.mapColorMovie are ray traced by the same kind of workers (see renderMovie).
+# Usage: 	python mapBatch.py manifest.csv --processes 8 --report report.tsv
+#
+#			Example manifest (CSV):
+#
+#			name,infile,structure,select,target,mode,color,reverse,adjust,maxCut,save
+#			UCEC.PIK3CA.ratio,mapvariant_lawrence2014_UCEC_ENST00000263967.txt,2RD0,"2RD0,A",identity.ratio,raw,samba.color,ON,1,0.005,UCEC_PIK3CA_ratio.png
+
+from __future__ import print_function
+import os, sys, csv, json, time, math, argparse, traceback
+import multiprocessing
+
+""" define job keys that are handled by the batch runner rather than passed to mapColor """
+batchKeys = ["name", "infile", "structure", "setup", "mode"]
+
+""" define job keys that are always read as text """
+textKeys = ["name", "infile", "structure", "setup", "save", "select", "target", "IDs", "position", "color"]
+
+""" define defaults for the batch jobs """
+jobDefaults = { "mode": "raw", "paint": "palette" }
+
+
+""" define a function to convert manifest strings to numbers where possible... """
+def parseValue(value):
+	if not isinstance(value, str):
+		return value
+	for kind in (int, float):
+		try:
+			return kind(value)
+		except ValueError:
+			pass
+	return value
+
+
+""" define a function to read a manifest of batch jobs... """
+def readManifest(manifest):
+
+	"""
+	manifest:	Path to a CSV, tab-delimited (.tsv/.txt) or JSON (list of objects) file of jobs.
+
+	Returns a list of job dictionaries; empty fields are dropped so that mapColor defaults apply.
+	"""
+
+	if manifest.endswith(".json"):
+		jobs = json.load(open(manifest))
+	else:
+		separator = "\t" if os.path.splitext(manifest)[1] in [".tsv", ".txt"] else ","
+		jobs = list(csv.DictReader(open(manifest), delimiter=separator))
+
+	outJobs = list()
+	for job in jobs:
+		job = dict((key.strip(), value.strip() if isinstance(value, str) else value) for key, value in job.items() if key and value not in ["", None])
+		job = dict((key, value if key in textKeys else parseValue(value)) for key, value in job.items())
+		for key, value in jobDefaults.items():
+			job.setdefault(key, value)
+		job.setdefault("name", job.get("save", job.get("infile")))
+		outJobs.append(job)
+	return outJobs
+
+
+""" define a function to split jobs into tasks that share a structure and setup... """
+def groupJobs(jobs, processes):
+
+	"""
+	jobs	:	List of job dictionaries.
+	processes:	Number of workers; large structure groups are split so that every worker gets work.
+
+	Returns a list of ((structure, setup), [(index, job), ...]) tasks, largest first.
+	"""
+
+	groups = dict()
+	for index, job in enumerate(jobs):
+		groups.setdefault((job.get("structure"), job.get("setup")), list()).append((index, job))
+
+	tasks = list()
+	for scene, members in groups.items():
+		size = int(math.ceil(float(len(members)) / processes))
+		for start in range(0, len(members), size):
+			tasks.append((scene, members[start:start + size]))
+	tasks.sort(key=lambda task: -len(task[1]))
+	return tasks
+
+
+""" define a function to start a headless PyMol instance in each worker process... """
+def startWorker(scriptPath, quiet=True):
+	global cmd, mapColor, loaded
+	if quiet:
+		sys.stdout = open(os.devnull, "w")
+	import pymol
+	pymol.finish_launching(["pymol", "-cq"])
+	from pymol import cmd
+
+	# ray tracing threads are spread over worker processes instead:
+	cmd.set("max_threads", 1)
+	sys.path.insert(0, scriptPath)
+	import mapColor
+	loaded = None
+
+
+""" define a function to run a group of jobs that share a structure and setup within a worker... """
+def renderTask(task):
+	global loaded
+	(structure, setup), members = task
+	results = list()
+	for index, job in members:
+		start = time.time()
+		result = { "index": index, "name": job["name"], "structure": structure, "worker": os.getpid() }
+		try:
+
+			# load the structure (and run its setup) once per worker, replacing the previous one:
+			if (structure, setup) != loaded:
+				cmd.reinitialize()
+				if structure is not None and os.path.isfile(structure):
+					cmd.load(structure)
+				elif structure is not None:
+					cmd.fetch(structure)
+				if setup is not None:
+					for command in setup.split(";"):
+						cmd.do(command.strip())
+				loaded = (structure, setup)
+			result["load"] = round(time.time() - start, 4)
+
+			# reset residue colors and color/render the job:
+			cmd.color(mapColor.setPalette("mapColor.empty", [mapColor.emptyColor])[0], "all")
+			options = dict((key, value) for key, value in job.items() if key not in batchKeys)
+			if options.get("save", "OFF") != "OFF" and os.path.dirname(options["save"]):
+				mapColor.pathGenerator(os.path.dirname(options["save"]))
+			mapColor.mapColor(job["infile"], job["mode"], **options)
+			result["status"] = "ok"
+			result["error"] = ""
+		except Exception as error:
+			loaded = None
+			result["status"] = "failed"
+			result["error"] = "%s: %s" % (type(error).__name__, error)
+			result["traceback"] = traceback.format_exc()
+		result["seconds"] = round(time.time() - start, 4)
+		results.append(result)
+	return results
+
+
+""" define a function to run all manifest jobs across a pool of headless PyMol workers... """
+def runBatch(manifest, processes=None, report="OFF", quiet=True):
+
+	"""
+	manifest:	Path to the job manifest (CSV, tab-delimited or JSON).
+	processes:	Number of worker processes; defaults to the number of cores.
+	report	:	Path to a tab-delimited report of per-job status and timing.
+	quiet	:	Silence mapColor output in the workers.
+	"""
+
+	jobs = readManifest(manifest)
+	processes = min(processes or multiprocessing.cpu_count(), max(len(jobs), 1))
+	tasks = groupJobs(jobs, processes)
+	scriptPath = os.path.dirname(os.path.abspath(__file__))
+
+	start = time.time()
+	results = list()
+	pool = multiprocessing.Pool(processes, initializer=startWorker, initargs=(scriptPath, quiet))
+	try:
+		for taskResults in pool.imap_unordered(renderTask, tasks):
+			for result in taskResults:
+				print("%s\t%s\t%.2fs" % (result["status"], result["name"], result["seconds"]))
+				if result["status"] != "ok":
+					print(result["traceback"], file=sys.stderr)
+			results.extend(taskResults)
+	finally:
+		pool.close()
+		pool.join()
+	elapsed = time.time() - start
+	results.sort(key=lambda result: result["index"])
+
+	# write report:
+	if report != "OFF":
+		columns = ["index", "name", "structure", "status", "seconds", "load", "worker", "error"]
+		outfile = open(report, "w")
+		print("\t".join(columns), file=outfile)
+		for result in results:
+			print("\t".join([ str(result.get(column, "")) for column in columns ]), file=outfile)
+		outfile.close()
+
+	failed = len([ result for result in results if result["status"] != "ok" ])
+	print("Jobs: %s, failed: %s, workers: %s, time: %.2fs" % (len(results), failed, processes, elapsed))
+	return results
+
+
+""" define a function to start a headless PyMol instance holding a saved session and a movie coloring, in each worker process... """
+def startMovieWorker(scriptPath, session, frameTable, quiet=True):
+	global movie
+	startWorker(scriptPath, quiet=quiet)
+	cmd.load(session)
+
+	# the first frame a worker renders colors every residue:
+	movie = dict(frameTable, frame=None)
+
+
+""" define a function to ray trace a block of consecutive movie frames within a worker... """
+def renderFrames(task):
+	start, stop, save, dpi, ray = task
+	results = list()
+	for frame in range(start, stop):
+		begin = time.time()
+		changed = mapColor.applyFrame(movie, frame)
+		outfile = mapColor.framePath(save, frame)
+		cmd.png(outfile, dpi=dpi, ray=ray)
+		results.append({ "frame": frame, "path": outfile, "changed": changed, "seconds": round(time.time() - begin, 4), "worker": os.getpid() })
+	return results
+
+
+""" define a function to ray trace the frames of a movie coloring with a pool of headless PyMol workers... """
+def renderMovie(session, frameTable, save, processes=None, dpi=300, ray=1, quiet=True):
+
+	"""
+	session	:	PyMol session (.pse) with the structure(s) and view to render.
+	frameTable:	Movie coloring (see mapColor.mapColorMovie).
+	save	:	Image path; frames are saved as numbered images (see mapColor.framePath).
+	processes:	Number of worker processes; defaults to the number of cores.
+	dpi		:	PyMol resolution; dots per inch.
+	ray		:	PyMol rendering mode.
+	quiet	:	Silence PyMol output in the workers.
+
+	Each worker gets blocks of consecutive frames, so it steps through them recoloring only the residues that change.
+	Workers are spawned rather than forked where possible, as the calling process may be a running PyMol session.
+	"""
+
+	frames = len(frameTable["frames"])
+	processes = min(processes or multiprocessing.cpu_count(), max(frames, 1))
+	size = max(1, int(math.ceil(float(frames) / processes)))
+	tasks = [ (start, min(start + size, frames), save, dpi, ray) for start in range(0, frames, size) ]
+	scriptPath = os.path.dirname(os.path.abspath(__file__))
+	context = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+
+	start = time.time()
+	results = list()
+	pool = context.Pool(processes, initializer=startMovieWorker, initargs=(scriptPath, session, frameTable, quiet))
+	try:
+		for taskResults in pool.imap_unordered(renderFrames, tasks):
+			for result in taskResults:
+				print(result["path"])
+			results.extend(taskResults)
+	finally:
+		pool.close()
+		pool.join()
+	results.sort(key=lambda result: result["frame"])
+	print("Frames: %s, workers: %s, time: %.2fs" % (len(results), processes, time.time() - start))
+	return results
+
+
+""" define the command-line interface... """
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Color and render mapColor jobs with a pool of headless PyMol workers.")
+	parser.add_argument("manifest", help="Job manifest (CSV, tab-delimited or JSON).")
+	parser.add_argument("--processes", type=int, default=None, help="Number of worker processes (default: number of cores).")
+	parser.add_argument("--report", default="OFF", help="Path to a tab-delimited per-job report.")
+	parser.add_argument("--verbose", action="store_true", help="Show mapColor output from the workers.")
+	options = parser.parse_args(arguments)
+	results = runBatch(options.manifest, processes=options.processes, report=options.report, quiet=not options.verbose)
+	return 1 if [ result for result in results if result["status"] != "ok" ] else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
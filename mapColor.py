@@ -9,10 +9,28 @@
 #			position adjustment factor, and colors:
 #			
 #			mapColor("/Users/claraya/Projects/wwMDs/data/structure/m2/kd/m2_testing_kd/mapstructure_m2_testing_kd_modeled_full.txt", mode="raw", color="samba", position="position", IDs="reference", target="function.delta.med", adjust=1, IDs="identity")
+#
+#			Several target columns of the same input file can be colored at once, storing one PyMol scene per column:
+#
+#			mapColorMulti("/Users/claraya/Projects/wwMDs/data/structure/m2/kd/m2_testing_kd/mapstructure_m2_testing_kd_modeled_full.txt", targets="function.delta.med,identity.ratio", mode="raw", color="samba.color", adjust=1)
+#
+#			Values over time points or MD states (one column, or one file, per frame) can be colored as a PyMol movie, each frame
+#			recoloring only the residues that change; frames can also be saved as a numbered PNG sequence (in parallel):
+#
+#			mapColorMovie(frames="t0,t1,t2,t3", infile="mapstructure_m2_timecourse.txt", mode="raw", color="samba.color", adjust=1, save="movie/m2.png", processes=4)
+#
+#			To find out where the time of a run goes (per-phase timings, residue/bin counts and PyMol API calls), add stats="ON"
+#			(and/or log="mapColor.jsonl", or profile="ON" for cProfile) and then run:  mapColorStats
+#
+#			Color ramps are built without matplotlib (only needed for ramps missing from colorDict, e.g. "viridis"). To
+#			precompute every ramp into data/colorRamps.npz, run once:  saveRamps()
 
-from pymol import cmd, stored
-import os, math, numpy
-import matplotlib as mpl
+from __future__ import print_function
+try:
+	from pymol import cmd, stored
+except ImportError:
+	cmd, stored = None, None
+import os, sys, csv, json, time, numpy, hashlib, tempfile, itertools, collections
 import bisect
 
 """ define empty-value/neutral colors """
@@ -123,6 +141,191 @@ colorDict = {
 	}
 
 
+""" define cache of color ramp lookup tables (and precomputed ramps file) """
+rampCache = collections.OrderedDict()
+rampCacheSize = 32
+rampFile = os.path.join(os.path.dirname(os.path.abspath(globals().get("__file__", "mapColor.py"))), "data", "colorRamps.npz")
+rampFiles = dict()
+
+""" define on-disk cache of residue color tables (see colorTable's cache option) """
+tableCacheDir = os.path.join(os.path.expanduser("~"), ".mapColor", "tables")
+tableCacheName = "mapColor.tables"
+tableCacheSize = 512 * 1024**2
+tableCacheVersion = 1
+fileHashes = dict()
+
+""" define cache of loaded and transformed input values """
+valueCache = collections.OrderedDict()
+valueCacheSize = 16
+
+""" define registry of precomputed movie colorings (see mapColorMovie), by movie name """
+movies = dict()
+
+""" define statistics of the last instrumented mapColor run (see mapColor's stats option and mapColorStats) """
+lastStats = None
+
+
+""" define backends that receive the PyMol API calls made while coloring... """
+class PymolBackend(object):
+	
+	"""
+	Forwards calls to PyMol's cmd module (values for cmd.alter are shared through pymol.stored).
+	"""
+	
+	def __init__(self, cmd=cmd, stored=stored):
+		if cmd is None:
+			raise ImportError("PyMol is not available; use a RecordingBackend or NullBackend instead.")
+		self.cmd, self.stored = cmd, stored
+	
+	def __getattr__(self, name):
+		return getattr(self.cmd, name)
+
+
+class RecordingBackend(object):
+	
+	"""
+	Records PyMol API calls instead of running them. Calls are counted by name in counts, and kept in calls if keep is "ON".
+	"""
+	
+	def __init__(self, keep="ON"):
+		self.keep, self.calls, self.counts = keep, list(), collections.Counter()
+		self.stored = Namespace()
+	
+	def __getattr__(self, name):
+		def record(*args, **kwargs):
+			self.counts[name] += 1
+			if self.keep == "ON":
+				self.calls.append((name, args, kwargs))
+		return record
+
+
+class NullBackend(object):
+	
+	"""
+	Ignores all PyMol API calls.
+	"""
+	
+	def __init__(self):
+		self.stored = Namespace()
+	
+	def __getattr__(self, name):
+		return lambda *args, **kwargs: None
+
+
+class Namespace(object):
+	pass
+
+
+""" define run statistics: phase timings, counts and PyMol API calls of an instrumented run... """
+class RunStats(object):
+	
+	"""
+	command	:	Name of the instrumented command.
+	options	:	Dictionary of the run's options (logged along with the statistics).
+	
+	Phases are timed with "with stats.phase(name):" blocks (repeated phases add up), counts are set directly and PyMol API
+	calls are counted and timed by name through a CountingBackend.
+	"""
+	
+	def __init__(self, command, options=dict()):
+		self.command, self.options = command, dict(options)
+		self.started, self.seconds = time.time(), None
+		self.phases, self.counts = collections.OrderedDict(), collections.OrderedDict()
+		self.calls, self.callSeconds = collections.Counter(), collections.Counter()
+		self.profile = None
+	
+	def __bool__(self):
+		return True
+	__nonzero__ = __bool__
+	
+	def phase(self, name):
+		return PhaseTimer(self, name)
+	
+	def finish(self):
+		self.seconds = time.time() - self.started
+	
+	def asDict(self):
+		""" define a method to export the statistics as plain (JSON-ready) values... """
+		return collections.OrderedDict([("command", self.command), ("started", self.started), ("seconds", self.seconds), ("phases", self.phases), ("counts", self.counts), ("calls", dict(self.calls)), ("callSeconds", dict(self.callSeconds)), ("options", self.options), ("profile", self.profile)])
+	
+	def report(self):
+		""" define a method to format the statistics as a short text report... """
+		lines = ["%s: %.4fs" % (self.command, self.seconds or 0.0)]
+		lines += [ "  phase %-10s %.4fs" % (name, seconds) for name, seconds in self.phases.items() ]
+		lines += [ "  count %-10s %s" % (name, value) for name, value in self.counts.items() ]
+		lines += [ "  call  %-10s %s (%.4fs)" % (name, self.calls[name], self.callSeconds[name]) for name in sorted(self.calls) ]
+		return "\n".join(lines)
+
+
+class NullStats(object):
+	
+	"""
+	Ignores all statistics (the default; phase blocks cost a no-op method call).
+	"""
+	
+	def __bool__(self):
+		return False
+	__nonzero__ = __bool__
+	
+	def phase(self, name):
+		return nullPhase
+
+
+class PhaseTimer(object):
+	
+	"""
+	Adds the time spent within a "with" block to a phase of a RunStats.
+	"""
+	
+	def __init__(self, stats=None, name=None):
+		self.stats, self.name = stats, name
+	
+	def __enter__(self):
+		self.start = time.time()
+	
+	def __exit__(self, *exception):
+		self.stats.phases[self.name] = self.stats.phases.get(self.name, 0.0) + time.time() - self.start
+
+
+class NullPhase(object):
+	def __enter__(self):
+		pass
+	def __exit__(self, *exception):
+		pass
+
+nullStats, nullPhase = NullStats(), NullPhase()
+
+
+class CountingBackend(object):
+	
+	"""
+	Counts and times the PyMol API calls made through another backend, into a RunStats.
+	"""
+	
+	def __init__(self, backend, stats):
+		self.backend, self.stats = backend, stats
+	
+	def __getattr__(self, name):
+		attribute = getattr(self.backend, name)
+		if not callable(attribute):
+			return attribute
+		def count(*args, **kwargs):
+			start = time.time()
+			try:
+				return attribute(*args, **kwargs)
+			finally:
+				self.stats.calls[name] += 1
+				self.stats.callSeconds[name] += time.time() - start
+		return count
+
+
+""" define a function to resolve the backend of a coloring call ("OFF" is the running PyMol session)... """
+def getBackend(backend="OFF"):
+	if isinstance(backend, str) and backend == "OFF":
+		return PymolBackend()
+	return backend
+
+
 """ define a function to construct a path """
 def pathGenerator(inpath):
 	if not os.path.isdir(inpath):
@@ -184,10 +387,36 @@ def findValues(values, cutoff, mode, report="fraction"):
 		return hits
 
 
+""" define a function to map an array of values onto color ramp indices... """
+def binValues(values, minColor, maxColor, N=256):
+
+	"""
+	values	:	Values to be mapped (list or array); non-finite values are returned as -1.
+	minColor:	Lowest value of the color range.
+	maxColor:	Highest value of the color range.
+	N		:	Color ramp size.
+
+	Returns an integer array of ramp indices, identical to findValues(floatRange(minColor, maxColor, N), value, mode="less.equal")*(N-1).
+	"""
+
+	values = numpy.asarray(values, dtype=float)
+	bins = numpy.full(values.shape, -1, dtype=int)
+	finite = numpy.isfinite(values)
+
+	# build the edges once and place all values with a single search (bisect_right):
+	edges = numpy.array(floatRange(minColor, maxColor, steps=N), dtype=float)
+	if len(edges) == 0:
+		bins[finite] = 0
+		return bins
+	fractions = numpy.searchsorted(edges, values[finite], side="right") / float(len(edges))
+	bins[finite] = (fractions * (N-1)).astype(int)
+	return bins
+
+
 """ define a function to build a dictionary of input i,x values... """
 def quickBuilder(infile, i, x, header="ON", separator="\t", mode="float"):
 	outDict = dict()
- 	inlines = open(infile).readlines()
+	inlines = open(infile).readlines()
 	if header == "ON":
 		headerDict = dict()
 		columns = inlines.pop(0).strip().split(separator)
@@ -213,12 +442,601 @@ def quickBuilder(infile, i, x, header="ON", separator="\t", mode="float"):
 	return outDict
 
 
+""" define a function to load any number of columns from a delimited file in a single pass... """
+def loadColumns(infile, columns, types=dict(), header="ON", separator="\t", quote="OFF", NA=["NA", ""], fill=float("nan"), chunk=100000):
+	
+	"""
+	infile	:	Path to delimited input file.
+	columns	:	Columns to be loaded, as header names (or integer indexes if header is "OFF").
+	types	:	Dictionary of column types ("int", "float" or "string"); columns default to "float".
+	header	:	Does the file start with a header line?
+	separator:	Column separator.
+	quote	:	Quote character (e.g. '"' for quoted CSV files); "OFF" disables quoting.
+	NA		:	Tokens treated as missing values in "float" columns.
+	fill	:	Value given to missing entries in "float" columns.
+	chunk	:	Number of lines parsed per batch.
+	
+	Returns a dictionary of NumPy arrays, one per requested column, in file order.
+	"""
+	
+	if quote == "OFF":
+		dialect = dict(delimiter=separator, quoting=csv.QUOTE_NONE)
+	else:
+		dialect = dict(delimiter=separator, quotechar=quote)
+	missing = set(NA)
+	toFloat = lambda token: fill if token in missing else float(token)
+	
+	inhandle = open(infile, "rb" if sys.version_info[0] < 3 else "r")
+	reader = csv.reader(inhandle, **dialect)
+	
+	# locate the requested columns:
+	if header == "ON":
+		names = next(reader)
+		indexes = dict()
+		for column in columns:
+			if column not in names:
+				inhandle.close()
+				raise ValueError("Column not found in %s: %s" % (infile, column))
+			indexes[column] = names.index(column)
+	else:
+		indexes = dict((column, int(column)) for column in columns)
+	
+	# parse lines in batches, converting each requested column to its type:
+	blocks = dict((column, list()) for column in columns)
+	while True:
+		rows = [ row for row in itertools.islice(reader, chunk) if row ]
+		if not rows:
+			break
+		for column in columns:
+			index, kind = indexes[column], types.get(column, "float")
+			tokens = [ row[index].strip() for row in rows ]
+			if kind == "float":
+				blocks[column].append(numpy.array([ toFloat(token) for token in tokens ], dtype=float))
+			elif kind == "int":
+				blocks[column].append(numpy.array([ int(token) for token in tokens ], dtype=int))
+			else:
+				blocks[column].append(numpy.array(tokens, dtype=object))
+	inhandle.close()
+	
+	# join the batches:
+	outDict = dict()
+	for column in columns:
+		kind = types.get(column, "float")
+		if blocks[column]:
+			outDict[column] = numpy.concatenate(blocks[column])
+		else:
+			outDict[column] = numpy.array([], dtype={ "float": float, "int": int }.get(kind, object))
+	return outDict
+
+
+""" define a function to build a PyMol selection for a set of residues... """
+def residueSelection(residues, select="OFF"):
+	
+	"""
+	residues:	Residue numbers to be selected.
+	select	:	Object and chain to restrict the selection to, as "object,chain".
+	
+	Consecutive residues are collapsed into ranges (e.g. "resi 1-4+9") to keep selections short.
+	"""
+	
+	residues = sorted(set(int(residue) for residue in residues))
+	resi = lambda residue: ("\\" if residue < 0 else "") + str(residue)
+	ranges = list()
+	for residue in residues:
+		if ranges and residue == ranges[-1][1] + 1:
+			ranges[-1][1] = residue
+		else:
+			ranges.append([residue, residue])
+	terms = [ resi(start) if start == stop else resi(start) + "-" + resi(stop) for start, stop in ranges ]
+	selection = "resi " + "+".join(terms)
+	if select != "OFF":
+		selection = "%s and chain %s" % tuple(select.split(",")) + " and " + selection
+	return selection
+
+
+""" define a function to color groups of residues with one PyMol call per group... """
+def paintGroups(residues, groups, colorNames, select="OFF", backend="OFF"):
+	
+	"""
+	residues:	Residue numbers, one per entry.
+	groups	:	Group (color) index for each residue; negative groups are left uncolored.
+	colorNames:	Registered PyMol color names, indexed by group.
+	select	:	Object and chain to restrict the coloring to, as "object,chain".
+	backend	:	Backend receiving the PyMol calls (see getBackend).
+	"""
+	
+	backend = getBackend(backend)
+	residues, groups = numpy.asarray(residues), numpy.asarray(groups)
+	order = numpy.argsort(groups, kind="mergesort")
+	starts = numpy.flatnonzero(numpy.diff(groups[order])) + 1
+	for members in numpy.split(order, starts):
+		if len(members) == 0 or groups[members[0]] < 0:
+			continue
+		backend.color(colorNames[groups[members[0]]], residueSelection(residues[members], select=select))
+
+
+""" define a function to register a list of colors in PyMol under a common prefix... """
+def setPalette(prefix, colors, backend="OFF"):
+	backend = getBackend(backend)
+	colorNames = list()
+	for k in range(0, len(colors)):
+		colorName = prefix + "." + str(k + 1)
+		r, g, b = colors[k][:3]
+		backend.set_color(colorName, str([float(r), float(g), float(b)]))
+		colorNames.append(colorName)
+	return colorNames
+
+
+""" define a function to interpolate a list of hex colors into an N-color RGBA ramp (as matplotlib's LinearSegmentedColormap.from_list)... """
+def interpolateRamp(colorMix, N=256):
+	stops = (N - 1) * numpy.linspace(0, 1, len(colorMix))
+	rgb = numpy.array([ [ int(hexColor[k:k+2], 16)/255.0 for k in (1, 3, 5) ] for hexColor in colorMix ])
+	samples = (N - 1) * numpy.linspace(0, 1, N)
+	index = numpy.searchsorted(stops, samples)[1:-1]
+	distance = (samples[1:-1] - stops[index - 1]) / (stops[index] - stops[index - 1])
+	lut = numpy.ones((N, 4))
+	lut[1:-1, :3] = distance[:, numpy.newaxis] * (rgb[index] - rgb[index - 1]) + rgb[index - 1]
+	lut[0, :3], lut[-1, :3] = rgb[0], rgb[-1]
+	return numpy.clip(lut, 0.0, 1.0)
+
+
+""" define a function to build the RGBA colors of a color ramp, through the ramp cache... """
+def rampColors(color, reverse="OFF", colorDict=colorDict, N=256):
+	
+	"""
+	color	:	Color ramp name; ramps missing from colorDict are looked up as matplotlib colormaps.
+	reverse	:	Reverse color ramp for value mapping.
+	N		:	Color ramp size.
+	
+	Returns an (N, 4) array of RGBA colors. Ramps are kept in a bounded LRU cache, keyed by (color, reverse, N).
+	"""
+	
+	colorMix = tuple(colorDict[color]) if color in colorDict else None
+	key = (color, reverse, N, colorMix)
+	if key in rampCache:
+		rampCache[key] = rampCache.pop(key)
+		return rampCache[key]
+	
+	# Load color map. Note that colors come inverted:
+	rampKey = "%s|%s|%s|%s" % (color, reverse, N, rampDigest(colorMix))
+	if colorMix is not None and rampKey in rampTables():
+		color256 = rampTables()[rampKey]
+	elif colorMix is not None:
+		color256 = interpolateRamp(colorMix[::-1] if reverse == "OFF" else colorMix, N=N)
+	else:
+		import matplotlib, matplotlib.cm
+		try:
+			if hasattr(matplotlib, "colormaps") and hasattr(matplotlib.colormaps[color], "resampled"):
+				colorMap = matplotlib.colormaps[color].resampled(N)
+			else:
+				colorMap = matplotlib.cm.get_cmap(color, N)
+		except (KeyError, ValueError):
+			raise ValueError("Color ramp not found in colorDict or matplotlib: %s" % color)
+		color256 = colorMap(numpy.arange(N))
+		if reverse == "OFF":
+			color256 = color256[::-1]
+	
+	# store the ramp, evicting the least recently used one if needed:
+	rampCache[key] = color256
+	while len(rampCache) > rampCacheSize:
+		rampCache.popitem(last=False)
+	return color256
+
+
+""" define a function to digest the hex colors of a ramp (precomputed ramps are only used while their colors are unchanged)... """
+def rampDigest(colorMix):
+	return hashlib.sha1(repr([ str(value).lower() for value in colorMix or [] ]).encode("utf-8")).hexdigest()[:16]
+
+
+""" define a function to load the precomputed color ramps, if available... """
+def rampTables(rampFile=rampFile):
+	if rampFile not in rampFiles:
+		rampFiles[rampFile] = dict(numpy.load(rampFile)) if os.path.isfile(rampFile) else dict()
+	return rampFiles[rampFile]
+
+
+""" define a function to precompute all color ramps into an .npz file... """
+def saveRamps(rampFile=rampFile, colorDict=colorDict, N=256):
+	tables = dict()
+	for color in colorDict:
+		for reverse in ["OFF", "ON"]:
+			colorMix = list(colorDict[color])
+			tables["%s|%s|%s|%s" % (color, reverse, N, rampDigest(colorMix))] = interpolateRamp(colorMix[::-1] if reverse == "OFF" else colorMix, N=N)
+	numpy.savez_compressed(rampFile, **tables)
+	rampFiles.pop(rampFile, None)
+	return rampFile
+
+
+""" define a function to load, sort and threshold mapColor input values... """
+def loadValues(infile, position, targets, IDs="OFF", maxCut="OFF", minCut="OFF"):
+	
+	"""
+	infile	:	Path to value input file.
+	position:	Position column in input file.
+	targets	:	Target value columns to load.
+	IDs		:	Identity column to load, if any.
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	
+	Returns the sorted positions, a dictionary of thresholded value arrays per target, and the identities (if requested).
+	"""
+	
+	# load positions, values and identities in a single pass:
+	types = { position: "int" }
+	if IDs != "OFF":
+		types[IDs] = "string"
+	table = loadColumns(infile, list(types.keys()) + [ target for target in targets if target not in types ], types=types)
+	
+	# sort by position, keeping the last entry of repeated positions:
+	reversePositions = table[position][::-1]
+	uniquePositions, lastIndexes = numpy.unique(reversePositions, return_index=True)
+	order = len(reversePositions) - 1 - lastIndexes
+	
+	# threshold the raw (input) values, if necessary:
+	rawTables = dict()
+	for target in targets:
+		rawArray = table[target][order]
+		if maxCut != "OFF":
+			rawArray = numpy.minimum(rawArray, float(maxCut))
+		if minCut != "OFF":
+			rawArray = numpy.maximum(rawArray, float(minCut))
+		rawTables[target] = rawArray
+	
+	# load IDs if specified:
+	rawIDs = table[IDs][order].tolist() if IDs != "OFF" else list()
+	return uniquePositions, rawTables, rawIDs
+
+
+""" define a function to normalize and transform values for coloring, in a single vectorized pass... """
+def transformValues(rawValues, mode, minValue="OFF", maxValue="OFF"):
+	
+	"""
+	rawValues:	Input (thresholded) values; missing values are NaN.
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
+	maxValue:	Maximum value for high-range normalization (or clipping; "clip" defaults to the 98th percentile).
+	minValue:	Minimum value for high-range normalization (or clipping; "clip" defaults to the 2nd percentile).
+	
+	Returns an array of transformed values. Missing, non-finite and (for log modes) non-positive values are returned as NaN.
+	"""
+	
+	values = numpy.array(rawValues, dtype=float)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		if mode == "log2":
+			values = numpy.log2(values)
+		elif mode == "log10":
+			values = numpy.log10(values)
+	values[~numpy.isfinite(values)] = numpy.nan
+	missing = numpy.isnan(values)
+	finite = values[~missing]
+	low = None if minValue == "OFF" else float(minValue)
+	high = None if maxValue == "OFF" else float(maxValue)
+	
+	with numpy.errstate(invalid="ignore"):
+		if mode in ["raw", "clip"]:
+			if mode == "clip" and finite.size:
+				low = numpy.percentile(finite, 2) if low is None else low
+				high = numpy.percentile(finite, 98) if high is None else high
+			colorValues = values
+			if low is not None:
+				colorValues = numpy.where(colorValues < low, low, colorValues)
+			if high is not None:
+				colorValues = numpy.where(colorValues > high, high, colorValues)
+		
+		# scale negative and positive values separately into [-1, 0) and (0, 1]:
+		elif mode in ["normalize", "log2", "log10"]:
+			if mode != "normalize" or low is None:
+				low = finite.min() if finite.size else None
+			if mode != "normalize" or high is None:
+				high = finite.max() if finite.size else None
+			negative, positive = values < 0, values > 0
+			colorValues = numpy.where(missing, numpy.nan, 0.0)
+			colorValues[negative] = -1*values[negative]/low
+			colorValues[positive] = values[positive]/high
+		
+		elif mode == "zscore":
+			scale = finite.std() if finite.size else 0
+			colorValues = (values - finite.mean())/scale if scale > 0 else numpy.where(missing, numpy.nan, 0.0)
+		
+		# quantiles, with tied values sharing their average rank:
+		elif mode in ["rank", "quantile"]:
+			ordered = numpy.sort(finite)
+			ranks = (numpy.searchsorted(ordered, values, side="left") + numpy.searchsorted(ordered, values, side="right") - 1)/2.0
+			colorValues = numpy.where(missing, numpy.nan, ranks/max(len(ordered) - 1, 1))
+		
+		else:
+			sys.exit("Error: choose a valid mode")
+	return colorValues
+
+
+""" define a function to load and transform target values, through the value cache... """
+def cachedValues(infile, position, targets, mode, IDs="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF"):
+	
+	"""
+	infile	:	Path to value input file.
+	position:	Position column in input file.
+	targets	:	Target value columns to load.
+	mode	:	Value transformation (see transformValues).
+	IDs		:	Identity column to load, if any.
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	maxValue:	Maximum value for high-range normalization.
+	minValue:	Minimum value for high-range normalization.
+	
+	Returns the sorted positions, the identities (if requested) and a dictionary of (raw, transformed) value arrays per target.
+	Targets are cached (read-only) by file, column, mode and cutoffs; a changed file (size or modification time) is reloaded.
+	"""
+	
+	status = os.stat(infile)
+	fileKey = (os.path.abspath(infile), status.st_size, status.st_mtime, position, IDs, mode, maxCut, minCut, maxValue, minValue)
+	
+	# load and transform the targets that are not cached, in a single pass:
+	missing = [ target for target in targets if fileKey + (target,) not in valueCache ]
+	if missing:
+		rawPositions, rawTables, rawIDs = loadValues(infile, position, missing, IDs=IDs, maxCut=maxCut, minCut=minCut)
+		rawPositions.setflags(write=False)
+		for target in missing:
+			rawValues = rawTables[target]
+			colorValues = transformValues(rawValues, mode, minValue=minValue, maxValue=maxValue)
+			rawValues.setflags(write=False)
+			colorValues.setflags(write=False)
+			valueCache[fileKey + (target,)] = (rawPositions, rawIDs, rawValues, colorValues)
+	
+	# collect the targets, refreshing their place in the cache:
+	values = dict()
+	for target in targets:
+		rawPositions, rawIDs, rawValues, colorValues = valueCache.pop(fileKey + (target,))
+		valueCache[fileKey + (target,)] = (rawPositions, rawIDs, rawValues, colorValues)
+		values[target] = (rawValues, colorValues)
+	while len(valueCache) > valueCacheSize:
+		valueCache.popitem(last=False)
+	return rawPositions, rawIDs, values
+
+
+""" define a function to place transformed values on the color ramp... """
+def rangeBins(colorValues, minValue="OFF", maxValue="OFF", N=256):
+	
+	"""
+	colorValues:	Transformed values.
+	maxValue:	Fixed upper end of the color range.
+	minValue:	Fixed lower end of the color range.
+	N		:	Color ramp size.
+	
+	Returns the values as an array, their ramp indices (-1 for non-finite values) and the color range.
+	"""
+	
+	# generate complete range of values (non-finite values are left out and colored as NA):
+	colorArray = numpy.array(colorValues, dtype=float)
+	finiteValues = colorArray[numpy.isfinite(colorArray)]
+	minColor, maxColor = (finiteValues.min(), finiteValues.max()) if finiteValues.size else (0.0, 0.0)
+	if minValue != "OFF":
+		minColor = float(minValue)
+	if maxValue != "OFF":
+		maxColor = float(maxValue)
+	colorBins = binValues(colorArray, minColor, maxColor, N=N)
+	return colorArray, colorBins, minColor, maxColor
+
+
+""" define a function to apply binned colors to residues in bulk... """
+def paintBins(residues, colorArray, colorBins, colorNames, minColor, maxColor, paint="palette", select="OFF", NA=emptyColor, altColor="OFF", rawValues=list(), backend="OFF"):
+	
+	"""
+	residues:	Residue numbers, one per value.
+	colorArray:	Transformed values.
+	colorBins:	Ramp index of each value (-1 for non-finite values).
+	colorNames:	Registered PyMol names of the ramp colors.
+	minColor:	Lower end of the color range.
+	maxColor:	Upper end of the color range.
+	paint	:	"palette" (one call per ramp color) or "spectrum" (b-factors and cmd.spectrum).
+	select	:	Object and chain to restrict the coloring to, as "object,chain".
+	NA		:	Color for non-finite values.
+	altColor:	Dictionary of raw values to colors; if given, only these residues are colored.
+	rawValues:	Raw values, used to look up altColor.
+	backend	:	Backend receiving the PyMol calls (see getBackend).
+	"""
+	
+	backend = getBackend(backend)
+	naName = setPalette("mapColor.NA", [NA], backend=backend)[0]
+	if altColor != "OFF":
+		altKeys = list(altColor.keys())
+		altNames = setPalette("mapColor.alt", [ altColor[key] for key in altKeys ], backend=backend)
+		groups = [ altKeys.index(value) if value in altColor else -1 for value in rawValues ]
+		paintGroups(residues, groups, altNames, select=select, backend=backend)
+	elif paint == "palette":
+		paintGroups(residues, numpy.where(colorBins < 0, len(colorNames), colorBins), list(colorNames) + [naName], select=select, backend=backend)
+	elif paint == "spectrum":
+		finite = colorBins >= 0
+		if finite.any():
+			backend.stored.mapColor = dict(zip([ str(residue) for residue in residues[finite] ], colorArray[finite].tolist()))
+			selection = residueSelection(residues[finite], select=select)
+			backend.alter(selection, "b = stored.mapColor.get(resi, b)")
+			backend.spectrum("b", " ".join(colorNames), selection, minimum=minColor, maximum=maxColor)
+		paintGroups(residues, numpy.where(finite, -1, 0), [naName], select=select, backend=backend)
+	else:
+		sys.exit("Error: choose a valid paint mode")
+
+
+""" define a function to build one PyMol selection per residue... """
+def residueSelections(residues, select="OFF"):
+	chain = "%s and chain %s and " % tuple(select.split(",")) if select != "OFF" else ""
+	return [ chain + "resi " + ("\\" if residue < 0 else "") + str(residue) for residue in numpy.asarray(residues).tolist() ]
+
+
+""" define a function to hash the contents of an input file (re-hashed only when its size or modification time change)... """
+def fileHash(infile):
+	status = os.stat(infile)
+	fileKey = (os.path.abspath(infile), status.st_size, status.st_mtime)
+	if fileKey not in fileHashes:
+		digest = hashlib.sha1()
+		inhandle = open(infile, "rb")
+		for block in iter(lambda: inhandle.read(1024**2), b""):
+			digest.update(block)
+		inhandle.close()
+		fileHashes[fileKey] = digest.hexdigest()
+	return fileHashes[fileKey]
+
+
+""" define a function to build the on-disk cache key of a residue color table... """
+def tableKey(infile, options):
+	options = [ sorted(option.items()) if isinstance(option, dict) else option for option in options ]
+	return hashlib.sha1(repr([tableCacheVersion, fileHash(infile)] + options).encode("utf-8")).hexdigest()
+
+
+""" define a function to store a residue color table in the on-disk cache... """
+def saveTable(table, key, cacheDir):
+	
+	"""
+	table	:	Residue color table (see colorTable).
+	key		:	Cache key (see tableKey).
+	cacheDir:	Cache directory.
+	
+	Per-residue columns are written as one structured .npy file (identities, if any, to a second one) next to a small
+	.json file holding the color range and NA color. Files are written to temporary names and then renamed into place.
+	"""
+	
+	pathGenerator(cacheDir)
+	fields = [("residue", "i8"), ("position", "i8"), ("bin", "i4"), ("colored", "?"), ("value", "f8"), ("raw", "f8"), ("rgb", "f8", (3,))]
+	records = numpy.zeros(len(table["residue"]), dtype=fields)
+	for field in fields:
+		records[field[0]] = table[field[0]]
+	outputs = { ".npy": records }
+	if "ID" in table:
+		outputs[".ids.npy"] = numpy.array(table["ID"], dtype="U")
+	outputs[".json"] = { "range": [ float(value) for value in table["range"] ], "NA": [ float(value) for value in table["NA"] ], "IDs": "ID" in table }
+	for extension in [".ids.npy", ".npy", ".json"]:
+		if extension not in outputs:
+			continue
+		outhandle, outfile = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+		outhandle = os.fdopen(outhandle, "w" if extension == ".json" else "wb")
+		if extension == ".json":
+			json.dump(outputs[extension], outhandle)
+		else:
+			numpy.save(outhandle, outputs[extension])
+		outhandle.close()
+		os.rename(outfile, os.path.join(cacheDir, key + extension))
+
+
+""" define a function to load a residue color table from the on-disk cache (memory-mapped)... """
+def loadTable(key, cacheDir):
+	infile = os.path.join(cacheDir, key + ".npy")
+	if not os.path.isfile(infile) or not os.path.isfile(os.path.join(cacheDir, key + ".json")):
+		return None
+	meta = json.load(open(os.path.join(cacheDir, key + ".json")))
+	records = numpy.load(infile, mmap_mode="r")
+	table = dict((field, records[field]) for field in records.dtype.names)
+	table.update({ "range": tuple(meta["range"]), "NA": meta["NA"] })
+	if meta["IDs"]:
+		table["ID"] = numpy.load(os.path.join(cacheDir, key + ".ids.npy")).tolist()
+	
+	# mark the entry as recently used:
+	os.utime(infile, None)
+	return table
+
+
+""" define a function to evict least recently used tables until the cache fits its size... """
+def evictTables(cacheDir, cacheSize=tableCacheSize):
+	entries = dict()
+	for filename in os.listdir(cacheDir):
+		
+		# only cache entries (named by their tableKey) are counted and evicted; temporary files are left to their writers:
+		key = filename.split(".")[0]
+		if len(key) != 40 or key.strip("0123456789abcdef") or filename not in [key + ".npy", key + ".ids.npy", key + ".json"]:
+			continue
+		path = os.path.join(cacheDir, filename)
+		size, used = entries.get(key, (0, 0))
+		entries[key] = (size + os.path.getsize(path), max(used, os.path.getmtime(path)) if filename == key + ".npy" else used)
+	total = sum([ size for size, used in entries.values() ])
+	for key in sorted(entries, key=lambda key: entries[key][1]):
+		if total <= cacheSize:
+			break
+		for extension in [".npy", ".ids.npy", ".json"]:
+			if os.path.isfile(os.path.join(cacheDir, key + extension)):
+				os.remove(os.path.join(cacheDir, key + extension))
+		total -= entries[key][0]
+
+
+""" define a function to compute the color of every residue, without PyMol... """
+def colorTable(infile, mode, color="wolfgang.v1", reverse="OFF", position="position", target="value", adjust=0, select="OFF", IDs="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", colorDict=colorDict, altColor="OFF", N=256, NA="OFF", cache="OFF", stats=nullStats):
+	
+	"""
+	infile	:	Path to value input file.
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
+	color	:	Color ramp to be used for value mapping.
+	reverse	:	Reverse color ramp for value mapping.
+	position:	Position column in input file.
+	target	:	Target value column to map to each position.
+	adjust	:	Integer describing how many residues into the chain to begin coloring.
+	select	:	Object and chain to restrict the coloring to, as "object,chain".
+	IDs		:	Should residue identities (chemicals) be read for each position? If so, specify identity column.
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	maxValue:	Maximum value for high-range normalization.
+	minValue:	Minimum value for high-range normalization.
+	altColor:	Dictionary of raw values to colors; if given, only these residues are colored.
+	N		:	Color ramp size.
+	NA		:	Color for missing or non-finite values (as [r, g, b]); defaults to emptyColor.
+	cache	:	Keep computed tables on disk ("ON" for tableCacheDir, or a directory, in which they are kept in a tableCacheName
+				subdirectory), keyed by input file contents and options.
+	stats	:	RunStats receiving the phase timings (ramp, cache, load, bin).
+	
+	Returns a dictionary of per-residue columns ("residue", "position", "selection", "rgb", "bin", "value", "raw", "colored" and,
+	if requested, "ID"), along with the ramp ("colors"), the color range ("range") and the NA color ("NA").
+	"""
+	
+	# Load color map:
+	with stats.phase("ramp"):
+		color256 = rampColors(color, reverse=reverse, colorDict=colorDict, N=N)
+	
+	# replay a cached table, if available:
+	if cache != "OFF":
+		with stats.phase("cache"):
+			cacheDir = tableCacheDir if cache == "ON" else os.path.join(cache, tableCacheName)
+			key = tableKey(infile, [mode, color, colorDict.get(color), reverse, position, target, adjust, IDs, maxCut, minCut, maxValue, minValue, altColor, N, NA])
+			table = loadTable(key, cacheDir)
+			if table is not None:
+				table.update({ "selection": residueSelections(table["residue"], select=select), "colors": color256 })
+				return table
+	
+	# load positions, values and identities, and normalize and transform values (if not cached):
+	with stats.phase("load"):
+		rawPositions, rawIDs, values = cachedValues(infile, position, [target], mode, IDs=IDs, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue)
+		rawValues, colorValues = values[target]
+	
+	with stats.phase("bin"):
+		
+		# generate complete range of values (non-finite values are left out and colored as NA):
+		colorArray, colorBins, minColor, maxColor = rangeBins(colorValues, minValue=minValue, maxValue=maxValue, N=N)
+		naColor = emptyColor if NA == "OFF" else NA
+		
+		# define residue colors (altColor residues only, if given):
+		rgb = numpy.asarray(color256)[numpy.maximum(colorBins, 0), :3]
+		rgb[colorBins < 0] = naColor[:3]
+		colored = numpy.ones(len(colorBins), dtype=bool)
+		if altColor != "OFF":
+			colored = numpy.array([ value in altColor for value in rawValues ], dtype=bool)
+			for index in numpy.flatnonzero(colored):
+				rgb[index] = altColor[rawValues[index]][:3]
+		
+		residues = numpy.arange(len(colorBins)) + adjust
+		table = { "residue": residues, "position": rawPositions, "rgb": rgb, "bin": colorBins, "value": colorArray, "raw": rawValues, "colored": colored }
+		if IDs != "OFF":
+			table["ID"] = rawIDs
+		table.update({ "range": (minColor, maxColor), "NA": naColor })
+	
+	# store the table on disk, if requested:
+	if cache != "OFF":
+		with stats.phase("cache"):
+			saveTable(table, key, cacheDir)
+			evictTables(cacheDir, tableCacheSize)
+	table.update({ "selection": residueSelections(residues, select=select), "colors": color256 })
+	return table
+
+
 """ define a function to color PDB structures from within PyMol... """
-def mapColor(infile, mode, color="wolfgang.v1", reverse="OFF", position="position", target="value", adjust=0, select="OFF", IDs="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", colorDict=colorDict, altColor="OFF", dpi=300, ray=1, N=256, save="OFF", NA="OFF"):
+def mapColor(infile, mode, color="wolfgang.v1", reverse="OFF", position="position", target="value", adjust=0, select="OFF", IDs="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", colorDict=colorDict, altColor="OFF", dpi=300, ray=1, N=256, save="OFF", NA="OFF", paint="residue", backend="OFF", cache="OFF", stats="OFF", log="OFF", profile="OFF"):
 	
 	"""
 	infile	:	Path to value input file.
-	mode	:	How should input values be treated? Options are "raw", "normalize" and "log2".
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
 	color	:	Color ramp to be used for value mapping.
 	reverse	:	Reverse color ramp for value mapping.
 	position:	Position column in input file.
@@ -232,157 +1050,379 @@ def mapColor(infile, mode, color="wolfgang.v1", reverse="OFF", position="positio
 	dpi		:	PyMol resolution; dots per inch.
 	ray		:	PyMol rendering mode.
 	N		:	Color ramp size.
+	NA		:	Color for missing or non-finite values (as [r, g, b]); defaults to emptyColor.
+	paint	:	How colors are applied. Options are "residue" (one named color per residue), "palette" (one call per ramp color) and "spectrum" (b-factors and cmd.spectrum).
+	backend	:	Backend receiving the PyMol calls; defaults to the running PyMol session (see getBackend).
+	cache	:	Keep computed residue colors on disk ("ON" for tableCacheDir, or a directory, in which they are kept in a
+				tableCacheName subdirectory), so reruns only apply colors.
+	stats	:	Time each phase (ramp, cache, load, bin, paint, save) and count residues, bins and PyMol API calls? The statistics
+				are printed, returned as table["stats"] (a RunStats) and kept for mapColorStats.
+	log		:	Path to a JSON-lines file the statistics of each run are appended to (implies stats).
+	profile	:	Run under cProfile (implies stats): "ON" prints the top functions, a path saves the profile (for pstats).
+	
+	Returns the residue color table (see colorTable).
 	"""
 	
-	# Load color map. Note that colors come inverted:
-	colorMix = list(colorDict[color])
-	if reverse == "OFF":
-		colorMix.reverse()
-	colorMap = mpl.colors.LinearSegmentedColormap.from_list(colorMix, colors=colorMix, N=N)
-	color256 = colorMap(numpy.arange(N))
-	
-	#for index in range(0, 255):
-	#	r, g, b, f = color256[index]
-	#	print index, ":", "	".join(map(str, [round(r, 2), round(g, 2), round(b, 2)]))
-	#print
-
-	print
-	print "ColorMap:", color
-	print "Colors:", len(color256)
-	print
-	
-	# load input file and intensity values:
-	rawDict = quickBuilder(infile, i=position, x=target, mode="float")
-	positions = sorted(rawDict.keys())
-	
-	# load reference identities if necessary:
-	if IDs != "OFF":
-		idDict = quickBuilder(infile, i=position, x=IDs, mode="string")
+	global lastStats
+	runStats = nullStats
+	if stats != "OFF" or log != "OFF" or profile != "OFF":
+		runStats = RunStats("mapColor", { "infile": infile, "mode": mode, "color": color, "reverse": reverse, "target": target, "select": select, "paint": paint, "N": N, "cache": cache, "save": save })
 	
-	# threshold the raw (input) values, if necessary:
-	rawValues, rawPositions, rawIDs = list(), list(), list()
-	for position in positions:
-		rawValue = float(rawDict[position])
-		if maxCut != "OFF":
-			rawValue = min(rawValue, maxCut)
-		if minCut != "OFF":
-			rawValue = max(rawValue, minCut)
-		rawValues.append(rawValue)
-		rawPositions.append(position)
+	backend = getBackend(backend)
+	if runStats:
+		backend = CountingBackend(backend, runStats)
+	if profile != "OFF":
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	try:
+		table = colorTable(infile, mode, color=color, reverse=reverse, position=position, target=target, adjust=adjust, select=select, IDs=IDs, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue, colorDict=colorDict, altColor=altColor, N=N, NA=NA, cache=cache, stats=runStats)
+		colorArray, colorBins, color256 = table["value"], table["bin"], table["colors"]
+		minColor, maxColor = table["range"]
+		finiteValues = colorArray[numpy.isfinite(colorArray)]
 		
-		# load IDs if specified:
-		if IDs != "OFF":
-			rawIDs.append(idDict[position])
-	
-	# normalize and transform values, if necessary:
-	colorValues = list()
-	if mode == "raw":
-		if minValue == "OFF" and maxValue == "OFF":
-			colorValues = rawValues
-		else:
-			for value in rawValues:
-				if minValue != "OFF" and value < float(minValue):
-					colorValues.append(minValue)
-				elif maxValue != "OFF" and value > float(maxValue):
-					colorValues.append(maxValue)
-				else:
-					colorValues.append(value)
+		print()
+		print("ColorMap:", color)
+		print("Colors:", len(color256))
+		print()
+		print("Input values (min, max):", finiteValues.min() if finiteValues.size else "NA", "-", finiteValues.max() if finiteValues.size else "NA")
+		print("Range values (min, max):", minColor, "-", maxColor)
+		print()
+		
+		with runStats.phase("paint"):
+			
+			# color residues one at a time, with a named color per residue:
+			if paint == "residue":
+				for index in numpy.flatnonzero(table["colored"]):
+					colorName = "res" + str(table["residue"][index]) if select == "OFF" else table["selection"][index]
+					r, g, b = table["rgb"][index]
+					backend.set_color(str(colorName), str([float(r), float(g), float(b)]))
+					backend.color(colorName, table["selection"][index])
 			
-	elif mode == "normalize":
-		for value in rawValues:
-			if value < 0 and minValue == "OFF":
-				colorValues.append(-1*value/min(rawValues))
-			elif value < 0 and minValue != "OFF":
-				colorValues.append(-1*value/float(minValue))
-			elif value > 0 and maxValue == "OFF":
-				colorValues.append(value/max(rawValues))
-			elif value > 0 and maxValue != "OFF":
-				colorValues.append(value/float(maxValue))
-			elif value == 0:
-				colorValues.append(0)
-	
-	elif mode == "log2":
-		log2Values = [ math.log(value, 2) for value in rawValues ]
-		for value in log2Values:
-			if value < 0:
-				colorValues.append(-1*value/min(log2Values))
-			elif value > 0:
-				colorValues.append(value/max(log2Values))
-			elif value == 0:
-				colorValues.append(0) 
-	
-	elif mode == "log10":
+			# color residues in bulk, registering the ramp once and issuing one call per color:
+			else:
+				colorNames = setPalette(color if reverse == "OFF" else color + ".rev", color256, backend=backend)
+				paintBins(table["residue"], colorArray, colorBins, colorNames, minColor, maxColor, paint=paint, select=select, NA=table["NA"], altColor=altColor, rawValues=table["raw"], backend=backend)
 		
-		logXValues = [ numpy.log10(value) for value in rawValues ]
+		# save image:
+		if save != "OFF":
+			print(save)
+			with runStats.phase("save"):
+				backend.png((save), dpi=dpi, ray=ray)
+	finally:
+		if profile != "OFF":
+			profiler.disable()
+	
+	if runStats:
+		finishStats(runStats, table, profiler if profile != "OFF" else None, profile=profile, log=log)
+		lastStats = runStats
+		table["stats"] = runStats
+		if stats != "OFF":
+			print(runStats.report())
+	return table
+
+
+""" define a function to complete the statistics of a mapColor run: counts, profile and log... """
+def finishStats(runStats, table, profiler=None, profile="OFF", log="OFF"):
+	
+	"""
+	runStats:	RunStats of the run.
+	table	:	Residue color table of the run (see colorTable).
+	profiler:	cProfile.Profile of the run, if any.
+	profile	:	"ON" to print the top functions of the profile, or a path to save it to.
+	log		:	Path to a JSON-lines file to append the statistics to.
+	"""
+	
+	runStats.finish()
+	colorBins = numpy.asarray(table["bin"])
+	runStats.counts.update([("residues", len(colorBins)), ("colored", int(numpy.count_nonzero(table["colored"]))), ("NA", int(numpy.count_nonzero(colorBins < 0))), ("bins", len(numpy.unique(colorBins[colorBins >= 0]))), ("colors", len(table["colors"])), ("calls", sum(runStats.calls.values()))])
+	
+	# summarize (or save) the profile:
+	if profiler is not None:
+		import pstats
+		if profile == "ON":
+			try:
+				from StringIO import StringIO
+			except ImportError:
+				from io import StringIO
+			stream = StringIO()
+			pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+			runStats.profile = stream.getvalue()
+			print(runStats.profile)
+		else:
+			profiler.dump_stats(profile)
+			runStats.profile = profile
+	
+	# append the statistics as one JSON line:
+	if log != "OFF":
+		if os.path.dirname(log):
+			pathGenerator(os.path.dirname(log))
+		outhandle = open(log, "a")
+		outhandle.write(json.dumps(runStats.asDict(), default=str) + "\n")
+		outhandle.close()
+
+
+""" define a function to color PDB structures by several target columns, storing a scene per column... """
+def mapColorMulti(infile, targets, mode, color="wolfgang.v1", reverse="OFF", position="position", adjust=0, select="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", colorDict=colorDict, altColor="OFF", dpi=300, ray=1, N=256, save="OFF", NA="OFF", paint="palette", backend="OFF"):
+	
+	"""
+	infile	:	Path to value input file.
+	targets	:	Target value columns to map, as a list or comma-separated string. Each one is stored as a scene of the same name.
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
+	color	:	Color ramp to be used for value mapping.
+	reverse	:	Reverse color ramp for value mapping.
+	position:	Position column in input file.
+	adjust	:	Integer describing how many residues into the chain to begin coloring.
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	maxValue:	Maximum value for high-range normalization.
+	minValue:	Minimum value for high-range normalization.
+	dpi		:	PyMol resolution; dots per inch.
+	ray		:	PyMol rendering mode.
+	N		:	Color ramp size.
+	save	:	Image path; one image is saved per target, with the target appended to the file name.
+	NA		:	Color for missing or non-finite values (as [r, g, b]); defaults to emptyColor.
+	paint	:	How colors are applied. Options are "palette" and "spectrum".
+	backend	:	Backend receiving the PyMol calls; defaults to the running PyMol session (see getBackend).
+	"""
+	
+	backend = getBackend(backend)
+	if not isinstance(targets, (list, tuple)):
+		targets = [ target.strip() for target in targets.split(",") ]
+	
+	# Load color map and register it once for all targets:
+	color256 = rampColors(color, reverse=reverse, colorDict=colorDict, N=N)
+	colorNames = setPalette(color if reverse == "OFF" else color + ".rev", color256, backend=backend)
+	naColor = emptyColor if NA == "OFF" else NA
+	
+	# load positions and all target values in a single pass, and transform them (if not cached):
+	rawPositions, rawIDs, values = cachedValues(infile, position, targets, mode, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue)
+	residues = numpy.arange(len(rawPositions)) + adjust
+	
+	# compute every color assignment before rendering:
+	assignments = dict()
+	for target in targets:
+		rawValues, colorValues = values[target]
+		assignments[target] = (rawValues,) + rangeBins(colorValues, minValue=minValue, maxValue=maxValue, N=N)
+	
+	# color residues, storing a scene (and saving an image) per target:
+	for target in targets:
+		rawValues, colorArray, colorBins, minColor, maxColor = assignments[target]
+		paintBins(residues, colorArray, colorBins, colorNames, minColor, maxColor, paint=paint, select=select, NA=naColor, altColor=altColor, rawValues=rawValues, backend=backend)
+		backend.scene(target, "store")
+		print(target, "(min, max):", minColor, "-", maxColor)
 		
-		for value in logXValues:
-			if value < 0 and not value == -float('Inf'):
-				colorValues.append(-1*value/min(logXValues))
-			elif value > 0 and not value == float('Inf'):
-				colorValues.append(value/max(logXValues))
-			elif value == 0:
-				colorValues.append(0)
-			elif value in [float('Inf'), -float('Inf'), float('NaN')]:
-				colorValues.append(NA)
-				print value, NA
+		# save image:
+		if save != "OFF":
+			root, extension = os.path.splitext(save)
+			outfile = root + "_" + target + (extension or ".png")
+			if os.path.dirname(outfile):
+				pathGenerator(os.path.dirname(outfile))
+			print(outfile)
+			backend.png(outfile, dpi=dpi, ray=ray)
+
+
+""" define a function to compute the colors of every movie frame up front... """
+def movieFrames(frames, mode, infile="OFF", target="value", position="position", adjust=0, maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", N=256, scale="global"):
+	
+	"""
+	frames	:	Frames in order, as a list or comma-separated string: target columns of infile or, if infile is "OFF", input files.
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
+	infile	:	Path to value input file holding one target column per frame.
+	target	:	Target value column of each frame file (if infile is "OFF").
+	position:	Position column in input file(s); frame files are aligned on the union of their positions.
+	adjust	:	Integer describing how many residues into the chain to begin coloring.
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	maxValue:	Maximum value for high-range normalization.
+	minValue:	Minimum value for high-range normalization.
+	N		:	Color ramp size.
+	scale	:	Color range shared by all frames ("global") or computed per frame ("frame").
+	
+	Returns a dictionary with the frame names ("frames"), residues ("residue"), positions ("position"), a frames x residues array
+	of transformed values ("value") and of ramp indices ("bin"; -1 for NA), the color range of each frame ("range") and the
+	residues whose bin changes at each step, as indexes ("changes") with per-step start offsets ("offsets").
+	"""
+	
+	if not isinstance(frames, (list, tuple)):
+		frames = [ frame.strip() for frame in frames.split(",") ]
 	
+	# load and transform all frames, as one frames x residues array (missing positions are NaN):
+	if infile != "OFF":
+		positions, rawIDs, values = cachedValues(infile, position, frames, mode, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue)
+		colorValues = numpy.array([ values[frame][1] for frame in frames ], dtype=float).reshape(len(frames), len(positions))
 	else:
-		sys.exit("Error: choose a valid mode")
+		loaded = [ cachedValues(frame, position, [target], mode, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue) for frame in frames ]
+		positions = numpy.unique(numpy.concatenate([ item[0] for item in loaded ]))
+		colorValues = numpy.full((len(frames), len(positions)), numpy.nan)
+		for index, (rawPositions, rawIDs, values) in enumerate(loaded):
+			colorValues[index, numpy.searchsorted(positions, rawPositions)] = values[target][1]
 	
-	# generate complete range of values:
-	minColor, maxColor = min(colorValues), max(colorValues)
-	if minValue != "OFF":
-		minColor = float(minValue)
-	if maxValue != "OFF":
-		maxColor = float(maxValue)
-	colorRanges = floatRange(minColor, maxColor, steps=N)
+	# place all frames on the color ramp at once (or frame by frame):
+	if scale == "global":
+		colorArray, colorBins, minColor, maxColor = rangeBins(colorValues, minValue=minValue, maxValue=maxValue, N=N)
+		ranges = [(minColor, maxColor)] * len(frames)
+	elif scale == "frame":
+		colorBins, ranges = numpy.zeros(colorValues.shape, dtype=int), list()
+		for index in range(0, len(frames)):
+			colorArray, colorBins[index], minColor, maxColor = rangeBins(colorValues[index], minValue=minValue, maxValue=maxValue, N=N)
+			ranges.append((minColor, maxColor))
+	else:
+		sys.exit("Error: choose a valid scale")
+	colorBins = colorBins.astype(numpy.int16 if N < 2**15 else numpy.int32)
 	
-	#[x for x in colorRanges if x != 'nan']
+	# encode each step as the residues whose bin changed:
+	steps, changes = numpy.nonzero(colorBins[1:] != colorBins[:-1])
+	offsets = numpy.concatenate([[0], numpy.bincount(steps, minlength=len(frames) - 1).cumsum()]).astype(int)
 	
-	print
-	print "Input values (min, max):", min(colorValues), "-", max(colorValues)
-	print "Range values (min, max):", min(colorRanges), "-", max(colorRanges)
-	print
+	return { "frames": list(frames), "residue": numpy.arange(len(positions)) + adjust, "position": positions, "value": colorValues, "bin": colorBins, "range": ranges, "changes": changes, "offsets": offsets }
+
+
+""" define a function to show a movie frame, recoloring only the residues whose bin differs from the frame shown... """
+def applyFrame(movie, frame, backend="OFF"):
 	
-	# color residues:
-	fraction = 0.1
-	for index in range(0, len(colorValues)):
+	"""
+	movie	:	Movie coloring (see mapColorMovie), or its name.
+	frame	:	Frame index (0-based).
+	backend	:	Backend receiving the PyMol calls; defaults to the running PyMol session (see getBackend).
 	
-		# define residue names:
-		if select == "OFF":
-			colorName = "res" + str(int(index) + adjust)
-		else:
-			colorName = "%s and chain %s" % tuple(select.split(",")) + " and resi " + str(int(index) + adjust)
-		fraction = findValues(colorRanges, float(colorValues[index]), mode="less.equal", report="fraction")
-		
-		# define residue color:
-		if altColor == "OFF":
-			r, g, b, f = color256[int(fraction*(N-1))]
-			cmd.set_color(str(colorName), str([r, g, b]))
-			cmd.color(colorName, colorName)
-			output = [int(index) + adjust, rawPositions[index], rawValues[index], fraction, colorName]
-			
-		# resets residue color:
-		if altColor != "OFF" and rawValues[index] in altColor:
-			r, g, b, f = altColor[rawValues[index]]
-			cmd.set_color(str(colorName), str([r, g, b]))
-			cmd.color(colorName, colorName)
-			output = [int(index) + adjust, rawPositions[index], rawValues[index], fraction, colorName]
-			
-		# record IDs, if requested:
-		if IDs != "OFF":
-			output.append(rawIDs[index])
-		#print "  ".join(map(str, output))
-	#print len(color256)
+	Steps to the next frame use the precomputed changes; other jumps compare the two frames' bins. The first frame shown
+	colors every residue. Returns the number of residues recolored.
+	"""
+	
+	backend = getBackend(backend)
+	movie = movies[movie] if isinstance(movie, str) else movie
+	frame, current, colorBins = int(frame), movie["frame"], movie["bin"]
+	if frame == current:
+		return 0
+	if current is None:
+		changed = numpy.arange(colorBins.shape[1])
+	elif frame == current + 1:
+		changed = movie["changes"][movie["offsets"][current]:movie["offsets"][frame]]
+	else:
+		changed = numpy.flatnonzero(colorBins[frame] != colorBins[current])
+	
+	groups = colorBins[frame][changed].astype(int)
+	paintGroups(movie["residue"][changed], numpy.where(groups < 0, len(movie["colorNames"]), groups), movie["colorNames"] + [movie["naName"]], select=movie["select"], backend=backend)
+	movie["frame"] = frame
+	return len(changed)
+
+
+""" define a function to build the numbered image path of a movie frame... """
+def framePath(save, frame):
+	root, extension = os.path.splitext(save)
+	return "%s_%04d%s" % (root, frame + 1, extension or ".png")
+
+
+""" define a function to color PDB structures by a sequence of frames (columns or files), as a PyMol movie... """
+def mapColorMovie(frames, mode, infile="OFF", target="value", color="wolfgang.v1", reverse="OFF", position="position", adjust=0, select="OFF", maxCut="OFF", minCut="OFF", maxValue="OFF", minValue="OFF", colorDict=colorDict, dpi=300, ray=1, N=256, save="OFF", NA="OFF", scale="global", name="mapColor", movie="ON", processes=1, backend="OFF"):
 	
-	# save image:
+	"""
+	frames	:	Frames in order, as a list or comma-separated string: target columns of infile or, if infile is "OFF", input files.
+	mode	:	How should input values be treated? Options are "raw", "clip", "normalize", "log2", "log10", "zscore" and "rank".
+	infile	:	Path to value input file holding one target column per frame.
+	target	:	Target value column of each frame file (if infile is "OFF").
+	color	:	Color ramp to be used for value mapping.
+	reverse	:	Reverse color ramp for value mapping.
+	position:	Position column in input file(s).
+	adjust	:	Integer describing how many residues into the chain to begin coloring.
+	select	:	Object and chain to restrict the coloring to, as "object,chain".
+	maxCut	:	Maximum value (cutoff) allowed for redefined value range.
+	minCut	:	Minimum value (cutoff) allowed for redefined value range.
+	maxValue:	Maximum value for high-range normalization.
+	minValue:	Minimum value for high-range normalization.
+	dpi		:	PyMol resolution; dots per inch.
+	ray		:	PyMol rendering mode.
+	N		:	Color ramp size.
+	save	:	Image path; one image is saved per frame, numbered from 1 (e.g. movie.png gives movie_0001.png, movie_0002.png, ...).
+	NA		:	Color for missing or non-finite values (as [r, g, b]); defaults to emptyColor.
+	scale	:	Color range shared by all frames ("global") or computed per frame ("frame").
+	name	:	Movie name, used by mapColorFrame.
+	movie	:	Set up the PyMol movie (one movie frame per frame, each running mapColorFrame)?
+	processes:	Number of headless PyMol workers ray tracing the saved frames (from a saved session; see mapBatch.renderMovie).
+	backend	:	Backend receiving the PyMol calls; defaults to the running PyMol session (see getBackend).
+	
+	All frame colors are computed before anything is drawn, and each frame only recolors the residues whose bin changed.
+	Returns the movie coloring (see movieFrames).
+	"""
+	
+	backend = getBackend(backend)
+	
+	# Load color map and register it once for all frames:
+	color256 = rampColors(color, reverse=reverse, colorDict=colorDict, N=N)
+	colorNames = setPalette(color if reverse == "OFF" else color + ".rev", color256, backend=backend)
+	naName = setPalette("mapColor.NA", [emptyColor if NA == "OFF" else NA], backend=backend)[0]
+	
+	# compute every frame's bins and per-step changes up front:
+	frameTable = movieFrames(frames, mode, infile=infile, target=target, position=position, adjust=adjust, maxCut=maxCut, minCut=minCut, maxValue=maxValue, minValue=minValue, N=N, scale=scale)
+	frameTable.update({ "name": name, "colorNames": colorNames, "naName": naName, "select": select, "frame": None })
+	movies[name] = frameTable
+	count, residues = len(frameTable["frames"]), len(frameTable["residue"])
+	
+	print()
+	print("ColorMap:", color)
+	print("Frames:", count, "Residues:", residues)
+	print("Changes:", len(frameTable["changes"]), "of", residues * max(count - 1, 0), "residue steps")
+	print()
+	
+	# show the first frame, and run mapColorFrame from each movie frame:
+	applyFrame(frameTable, 0, backend=backend)
+	if movie == "ON":
+		backend.mset("1 x%s" % count)
+		for frame in range(0, count):
+			backend.mdo(frame + 1, "mapColorFrame %s, %s" % (name, frame))
+	
+	# save images, in this session or ray traced by headless workers from a saved session:
 	if save != "OFF":
-		print save
-		cmd.png((save), dpi=dpi, ray=ray)
+		if os.path.dirname(save):
+			pathGenerator(os.path.dirname(save))
+		if int(processes) > 1:
+			scriptPath = os.path.dirname(os.path.abspath(globals().get("__file__", "mapColor.py")))
+			if scriptPath not in sys.path:
+				sys.path.insert(0, scriptPath)
+			import mapBatch
+			session = tempfile.mkstemp(suffix=".pse")
+			os.close(session[0])
+			try:
+				backend.save(session[1])
+				mapBatch.renderMovie(session[1], frameTable, save, processes=int(processes), dpi=dpi, ray=ray)
+			finally:
+				os.remove(session[1])
+		else:
+			for frame in range(0, count):
+				applyFrame(frameTable, frame, backend=backend)
+				print(framePath(save, frame))
+				backend.png(framePath(save, frame), dpi=dpi, ray=ray)
+	return frameTable
+
+
+""" define a function to show a frame of a movie set up by mapColorMovie (run from the PyMol movie)... """
+def mapColorFrame(name, frame, backend="OFF"):
+	applyFrame(movies[name], int(frame), backend=backend)
+
+
+""" define a function to show the statistics of the last instrumented mapColor run (stats, log or profile on)... """
+def mapColorStats(log="OFF"):
+	
+	"""
+	log		:	Path to a JSON-lines file to append the statistics to.
+	
+	Returns the statistics as a dictionary (None if no run was instrumented).
+	"""
+	
+	if lastStats is None:
+		print("No statistics: run mapColor with stats=ON (or log/profile) first.")
+		return None
+	print(lastStats.report())
+	if log != "OFF":
+		outhandle = open(log, "a")
+		outhandle.write(json.dumps(lastStats.asDict(), default=str) + "\n")
+		outhandle.close()
+	return lastStats.asDict()
 
 
 """ define a function to generate colors for PyMol... """
-def genColor(color="wolfgang.v1", reverse="OFF", colorDict=colorDict, dpi=300, ray=1, N=256):
+def genColor(color="wolfgang.v1", reverse="OFF", colorDict=colorDict, dpi=300, ray=1, N=256, backend="OFF"):
 	
 	"""
 	color	:	Color ramp to be used for value mapping.
@@ -392,28 +1432,26 @@ def genColor(color="wolfgang.v1", reverse="OFF", colorDict=colorDict, dpi=300, r
 	dpi		:	PyMol resolution; dots per inch.
 	ray		:	PyMol rendering mode.
 	N		:	Color ramp size.
+	backend	:	Backend receiving the PyMol calls; defaults to the running PyMol session (see getBackend).
 	"""
 	
-	# Load color map. Note that colors come inverted:
-	colorMix = list(colorDict[color])
-	if reverse == "OFF":
-		colorMix.reverse()
-	colorMap = mpl.colors.LinearSegmentedColormap.from_list(colorMix, colors=colorMix, N=N)
-	color256 = colorMap(numpy.arange(N))
-	
-	print
-	print "ColorMap:", color
-	print "Colors:", len(color256)
-	print
-	
-	# color residues:
-	k = 1
-	for i in color256:
-		colorName = color + "." + str(k)
-		r, g, b, f = color256[k]
-		cmd.set_color(colorName, str([r, g, b]))
-	
-cmd.extend("mapColor", mapColor)
+	# Load color map:
+	color256 = rampColors(color, reverse=reverse, colorDict=colorDict, N=N)
+	
+	print()
+	print("ColorMap:", color)
+	print("Colors:", len(color256))
+	print()
+	
+	# register colors:
+	return setPalette(color if reverse == "OFF" else color + ".rev", color256, backend=backend)
+
+if cmd is not None:
+	cmd.extend("mapColor", mapColor)
+	cmd.extend("mapColorMulti", mapColorMulti)
+	cmd.extend("mapColorMovie", mapColorMovie)
+	cmd.extend("mapColorFrame", mapColorFrame)
+	cmd.extend("mapColorStats", mapColorStats)
 
 # Visualization example: PIK3CA-PIK3R1 UCEC ENST00000263967 (2RD0)
 
@@ -0,0 +1,817 @@
+#!/usr/bin/env python
+# This is a script that finds the degree of overlap between two ranked gene signatures (rank-rank enrichment), as
+# compare_overlap_between_two_genesets in mapOverlap.r does.
+# Note: 	Genes are compared as given (e.g. "SYMBOL|ENTREZ" keys), or as int32 IDs of a GeneIndex built once from the
+#			background list (kept memory-mapped next to it, and matching keys, symbols or Entrez IDs); as in mapOverlap.r,
+#			the background list only sets the total number of genes. Each gene is mapped to its (first) rank in both signatures, and the overlap counts of
+#			every pair of top-k*granularity and top-l*granularity prefixes are read off cumulative sums of a single 2D rank
+#			histogram, so the whole K x L grid of 2x2 tables costs O(K*L) instead of O(K*L*n) set operations. The grid is
+#			tested at once as R's fisher.test does (conditional MLE odds ratio and two-sided p-value), with densities shared
+#			by tables with the same margins; fisherGrid documents its tolerance against R. permuteOverlap adds FWER and FDR
+#			adjusted matrices from a permutation null (random background lists in place of the second signature).
+# Usage: 	From Python:
+#
+#			import mapOverlap
+#			background = mapOverlap.openGeneIndex("data/Background_List.txt")
+#			geneset1 = mapOverlap.readSignature("data/BLCA_NFE2L2.csv", index=background)
+#			geneset2 = mapOverlap.readSignature("data/HNSC_NFE2L2.csv", index=background)
+#			overlap = mapOverlap.compareOverlap(geneset1, geneset2, background, granularity=10)
+#
+#			From the command line (writes <output>_ODDS.txt and <output>_PVAL.txt):
+#
+#			python mapOverlap.py data/BLCA_NFE2L2.csv data/HNSC_NFE2L2.csv data/Background_List.txt --granularity 10 --output BLCA_HNSC
+#
+#			With a permutation null (also writes <output>_FWER.txt and <output>_FDR.txt):
+#
+#			python mapOverlap.py data/BLCA_NFE2L2.csv data/HNSC_NFE2L2.csv data/Background_List.txt --permutations 1000 --processes 8 --output BLCA_HNSC
+
+from __future__ import print_function
+import os, sys, json, math, argparse, tempfile
+import multiprocessing
+import numpy
+
+from mapColor import loadColumns
+
+""" define the overlap map colors (as in mapOverlap.r) """
+overlapColors = ["#3362A5", "#1E90FF", "#00BFFF", "#FCFCFC", "#FFD700", "#EE2C2C", "#A31D1D"]
+
+""" define the root finding tolerance and iteration limit used by R's uniroot (for the odds ratio estimate) """
+rootTolerance = numpy.finfo(float).eps ** 0.25
+rootIterations = 1000
+
+""" define the log p-value tolerance for ties between observed and permutation statistics (as R's relErr) """
+tieTolerance = 1e-7
+
+""" define the permutation worker state (views of the shared arrays, set up once per worker process) """
+permutationState = dict()
+
+""" define the shared table of log factorials (grown to the largest table total seen) """
+logFactorials = numpy.zeros(1)
+
+""" define the gene index file format version (bump to invalidate indexes written by older versions) """
+geneIndexVersion = 1
+
+
+""" define a gene identifier index: background "SYMBOL|ENTREZ" keys interned as int32 IDs, with symbol and Entrez lookups... """
+class GeneIndex(object):
+
+	"""
+	records	:	Structured array (usually memory-mapped, see openGeneIndex) with the keys in ID order ("key") and the
+				keys, symbols and Entrez IDs in sorted order ("sortedKey", "sortedSymbol", "sortedEntrez") next to the
+				gene IDs they belong to ("keyOrder", "symbolOrder", "entrezOrder").
+
+	Genes are matched by their full key, then by Entrez ID, then (symbol-only inputs) by symbol, so symbol-only or
+	Entrez-only inputs map to the same IDs. Entrez IDs and symbols shared by several background genes (e.g. "?") match
+	none of them. Genes outside the background get IDs from len(index) on (kept in memory only).
+	"""
+
+	def __init__(self, records):
+		self.records = records
+		self.extra = dict()
+
+	def __len__(self):
+		return len(self.records)
+
+	def find(self, field, queries, unique="OFF"):
+		""" define a method to look up queries in a sorted column, returning gene IDs (-1 if missing, or if ambiguous and unique is "ON")... """
+		column = self.records["sorted" + field]
+		if not len(column) or not len(queries):
+			return numpy.zeros(len(queries), dtype=numpy.int32) - 1
+		positions = numpy.minimum(numpy.searchsorted(column, queries), len(column) - 1)
+		found = column[positions] == queries
+		if unique == "ON":
+			found &= numpy.searchsorted(column, queries, side="right") - positions == 1
+		return numpy.where(found, self.records[field[0].lower() + field[1:] + "Order"][positions], -1).astype(numpy.int32)
+
+	def lookup(self, genes, add="ON"):
+
+		"""
+		genes	:	Gene keys ("SYMBOL|ENTREZ"), symbols or Entrez IDs.
+		add		:	Give genes outside the background new IDs (or -1 if "OFF")?
+
+		Returns an int32 array of gene IDs.
+		"""
+
+		tokens = [ str(gene).strip() for gene in genes ]
+		ids = self.find("Key", numpy.array([ token.encode("utf-8") for token in tokens ], dtype=bytes))
+
+		# fall back to the Entrez ID, then (for symbol-only inputs) to the symbol, matching unambiguous ones only:
+		missing = numpy.nonzero(ids < 0)[0]
+		if len(missing):
+			entrez = [ token.split("|")[-1] for token in [ tokens[index] for index in missing ] ]
+			entrez = numpy.array([ int(value) if value.isdigit() else -1 for value in entrez ], dtype=numpy.int32)
+			ids[missing] = numpy.where(entrez >= 0, self.find("Entrez", entrez, unique="ON"), -1)
+		missing = [ index for index in numpy.nonzero(ids < 0)[0] if "|" not in tokens[index] ]
+		if len(missing):
+			symbols = [ tokens[index].encode("utf-8") for index in missing ]
+			ids[missing] = self.find("Symbol", numpy.array(symbols, dtype=bytes), unique="ON")
+		if add == "ON":
+			for index in numpy.nonzero(ids < 0)[0]:
+				ids[index] = self.extra.setdefault(tokens[index], len(self) + len(self.extra))
+		return ids
+
+	def genes(self, ids):
+		""" define a method to convert gene IDs back to keys... """
+		extra = dict((value, key) for key, value in self.extra.items())
+		return [ self.records["key"][value].decode("utf-8") if value < len(self) else extra.get(value) for value in ids ]
+
+
+""" define a function to build the records of a gene index from background keys... """
+def indexRecords(genes):
+	keys = [ gene.encode("utf-8") for gene in genes ]
+	symbols = [ key.split(b"|")[0] for key in keys ]
+	entrez = [ key.split(b"|")[-1] if b"|" in key else b"" for key in keys ]
+	entrez = numpy.array([ int(value) if value.isdigit() else -1 for value in entrez ], dtype=numpy.int32)
+	width = max([ len(key) for key in keys ] + [1])
+
+	fields = [("key", "S%s" % width), ("sortedKey", "S%s" % width), ("keyOrder", "i4"), ("sortedSymbol", "S%s" % width), ("symbolOrder", "i4"), ("sortedEntrez", "i4"), ("entrezOrder", "i4")]
+	records = numpy.zeros(len(keys), dtype=fields)
+	records["key"] = keys
+	for field, values in [("Key", records["key"]), ("Symbol", numpy.array(symbols, dtype="S%s" % width)), ("Entrez", entrez)]:
+		order = numpy.argsort(values, kind="mergesort")
+		records["sorted" + field] = values[order]
+		records[field[0].lower() + field[1:] + "Order"] = order
+	return records
+
+
+""" define a function to open the gene index of a background list, building it on first use... """
+def openGeneIndex(background, cache="ON"):
+
+	"""
+	background:	Path to background list (e.g. data/Background_List.txt).
+	cache	:	Keep the index next to the background list (<background>.genes.npy, memory-mapped on later runs)?
+
+	Returns a GeneIndex whose IDs follow the background list order.
+	"""
+
+	indexFile, metaFile = background + ".genes.npy", background + ".genes.json"
+	source = { "version": geneIndexVersion, "size": os.path.getsize(background), "mtime": os.path.getmtime(background) }
+	if cache == "ON" and os.path.isfile(indexFile) and os.path.isfile(metaFile) and json.load(open(metaFile)) == source:
+		return GeneIndex(numpy.load(indexFile, mmap_mode="r"))
+
+	records = indexRecords(readBackground(background))
+	if cache != "ON":
+		return GeneIndex(records)
+
+	# write to temporary names and rename into place (skip if the directory is read-only):
+	try:
+		for outfile, content in [(indexFile, records), (metaFile, source)]:
+			outhandle, tempfile_ = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outfile)), suffix=".tmp")
+			outhandle = os.fdopen(outhandle, "w" if outfile == metaFile else "wb")
+			if outfile == metaFile:
+				json.dump(content, outhandle)
+			else:
+				numpy.save(outhandle, content)
+			outhandle.close()
+			os.rename(tempfile_, outfile)
+	except (IOError, OSError):
+		return GeneIndex(records)
+	return GeneIndex(numpy.load(indexFile, mmap_mode="r"))
+
+
+""" define a function to read a ranked gene signature (e.g. a limma table, sorted by significance)... """
+def readSignature(infile, column="", separator=",", quote='"', index=None):
+
+	"""
+	infile	:	Path to signature table (e.g. data/BLCA_NFE2L2.csv).
+	column	:	Gene column (limma tables keep the genes in the unnamed first column).
+	separator:	Column separator.
+	quote	:	Quote character ("OFF" disables quoting).
+	index	:	GeneIndex to convert the genes to (keys, symbols or Entrez IDs are all matched).
+
+	Returns the genes in file order, as an int32 array of gene IDs if an index is given.
+	"""
+
+	genes = list(loadColumns(infile, [column], types={ column: "string" }, separator=separator, quote=quote)[column])
+	return genes if index is None else index.lookup(genes)
+
+
+""" define a function to read a background gene list... """
+def readBackground(infile, column="x", separator=",", quote='"'):
+
+	"""
+	infile	:	Path to background list, one gene per line under a header (e.g. data/Background_List.txt).
+	column	:	Gene column.
+	separator:	Column separator.
+	quote	:	Quote character ("OFF" disables quoting).
+	"""
+
+	return list(loadColumns(infile, [column], types={ column: "string" }, separator=separator, quote=quote)[column])
+
+
+""" define a function to turn gene lists into integer codes (gene ID arrays are used as they are)... """
+def geneCodes(*genesets):
+	if all([ isinstance(geneset, numpy.ndarray) and geneset.dtype.kind in "iu" for geneset in genesets ]):
+		return [ geneset.astype(numpy.int64) for geneset in genesets ]
+	index = dict()
+	return [ numpy.array([ index.setdefault(gene, len(index)) for gene in geneset ], dtype=numpy.int64) for geneset in genesets ]
+
+
+""" define a function to find the first rank of every gene code in a signature... """
+def firstRanks(codes, size):
+
+	"""
+	codes	:	Integer codes of the ranked genes.
+	size	:	Number of distinct codes (rank array length).
+
+	Returns the (0-based) rank of every code's first occurrence (the signature length for absent codes), and the
+	first-occurrence flags of the signature.
+	"""
+
+	rank = numpy.zeros(size, dtype=numpy.int64) + len(codes)
+	first = numpy.zeros(len(codes), dtype=bool)
+	values, positions = numpy.unique(codes, return_index=True)
+	rank[values] = positions
+	first[positions] = True
+	return rank, first
+
+
+""" define a function to rank the genes of one or two signatures... """
+def rankGenes(geneset1, geneset2):
+
+	"""
+	geneset1:	Ranked genes (or gene IDs) of the first signature.
+	geneset2:	Ranked genes (or gene IDs) of the second signature.
+
+	Returns arrays with the (0-based) rank of every distinct gene's first occurrence in each signature, or the signature
+	length for genes that only occur in the other one, and the first-occurrence flags of each signature.
+	"""
+
+	codes1, codes2 = geneCodes(geneset1, geneset2)
+	size = int(max([ codes.max() + 1 for codes in [codes1, codes2] if len(codes) ] + [0]))
+	rank1, first1 = firstRanks(codes1, size)
+	rank2, first2 = firstRanks(codes2, size)
+	return rank1, rank2, first1, first2
+
+
+""" define a function to count the overlap of every pair of signature prefixes... """
+def overlapCounts(geneset1, geneset2, total, granularity=10):
+
+	"""
+	geneset1:	Ranked genes of the first signature (rows).
+	geneset2:	Ranked genes of the second signature (columns).
+	total	:	Total number of genes (the background list length).
+	granularity:	Number of genes added to each prefix at every step.
+
+	Returns the in_both, in_one, in_two and neither count matrices; cell [k-1, l-1] is the 2x2 table of the top
+	k*granularity genes of geneset1 against the top l*granularity genes of geneset2 (distinct genes, as R's intersect,
+	setdiff and union).
+	"""
+
+	K, L = len(geneset1) // granularity, len(geneset2) // granularity
+	rank1, rank2, first1, first2 = rankGenes(geneset1, geneset2)
+
+	inBoth = sharedCounts(rank1, rank2, K, L, granularity)
+	size1, size2 = prefixSizes(first1, K, granularity), prefixSizes(first2, L, granularity)
+
+	inOne = size1[:, None] - inBoth
+	inTwo = size2[None, :] - inBoth
+	neither = total - (size1[:, None] + size2[None, :] - inBoth)
+	return inBoth, inOne, inTwo, neither
+
+
+""" define a function to count the genes shared by every pair of signature prefixes from their ranks... """
+def sharedCounts(rank1, rank2, K, L, granularity):
+
+	"""
+	rank1	:	Rank of each gene in the first signature (anything past the K prefixes for absent genes).
+	rank2	:	Rank of each gene in the second signature (anything past the L prefixes for absent genes).
+	K, L	:	Number of prefixes of each signature.
+	granularity:	Number of genes added to each prefix at every step.
+
+	Returns the K x L in_both matrix: a 2D histogram of the (rank1, rank2) steps of the shared genes, accumulated
+	over both axes.
+	"""
+
+	shared = (rank1 < K * granularity) & (rank2 < L * granularity)
+	cells = (rank1[shared] // granularity) * L + rank2[shared] // granularity
+	histogram = numpy.bincount(cells, minlength=K * L).reshape(K, L)
+	return histogram.cumsum(axis=0).cumsum(axis=1)
+
+
+""" define a function to count the distinct genes of every signature prefix... """
+def prefixSizes(first, count, granularity):
+	if not count:
+		return numpy.zeros(0, dtype=int)
+	return first[:count * granularity].reshape(count, granularity).sum(axis=1).cumsum()
+
+
+""" define a function to find a root as R's uniroot does (Brent's method, R_zeroin2)... """
+def zeroin(function, lower, upper, tolerance=rootTolerance, iterations=rootIterations):
+	a, b = float(lower), float(upper)
+	fa, fb = function(a), function(b)
+	if fa == 0.0:
+		return a
+	if fb == 0.0:
+		return b
+	if fa * fb > 0:
+		raise ValueError("Function values at both interval ends have the same sign")
+	c, fc = a, fa
+	epsilon = numpy.finfo(float).eps
+
+	for iteration in range(0, iterations + 1):
+		previous = b - a
+		if abs(fc) < abs(fb):
+			a, b, c = b, c, b
+			fa, fb, fc = fb, fc, fb
+		actual = 2 * epsilon * abs(b) + tolerance / 2
+		step = (c - b) / 2
+		if abs(step) <= actual or fb == 0.0:
+			return b
+
+		# try interpolation (linear with two distinct points, inverse quadratic otherwise):
+		if abs(previous) >= actual and abs(fa) > abs(fb):
+			cb = c - b
+			if a == c:
+				t1 = fb / fa
+				p = cb * t1
+				q = 1.0 - t1
+			else:
+				q, t1, t2 = fa / fc, fb / fc, fb / fa
+				p = t2 * (cb * q * (q - t1) - (b - a) * (t1 - 1.0))
+				q = (q - 1.0) * (t1 - 1.0) * (t2 - 1.0)
+			if p > 0:
+				q = -q
+			else:
+				p = -p
+			if p < (0.75 * cb * q - abs(actual * q) / 2) and p < abs(previous * q / 2):
+				step = p / q
+
+		if abs(step) < actual:
+			step = actual if step > 0 else -actual
+		a, fa = b, fb
+		b += step
+		fb = function(b)
+		if (fb > 0 and fc > 0) or (fb < 0 and fc < 0):
+			c, fc = a, fa
+	return b
+
+
+""" define a function to run Fisher's exact test on a 2x2 table as R's fisher.test does... """
+def fisherTest(inBoth, inOne, inTwo, neither):
+
+	"""
+	inBoth	:	Genes in both sets.
+	inOne	:	Genes in the first set only.
+	inTwo	:	Genes in the second set only.
+	neither	:	Genes in neither set.
+
+	Returns the conditional maximum likelihood odds ratio estimate and the two-sided p-value.
+	"""
+
+	m, n, k, x = inBoth + inTwo, inOne + neither, inBoth + inOne, inBoth
+	lo, hi = max(0, k - n), min(k, m)
+	support = numpy.arange(lo, hi + 1)
+
+	# log hypergeometric densities over the support, and noncentral densities/means:
+	logdc = lchoose(m, support) + lchoose(n, k - support) - lchoose(m + n, k)
+	def dnhyper(ncp):
+		d = logdc + math.log(ncp) * support
+		d = numpy.exp(d - d.max())
+		return d / d.sum()
+	def mnhyper(ncp):
+		if ncp == 0:
+			return lo
+		if ncp == float("inf"):
+			return hi
+		return (support * dnhyper(ncp)).sum()
+
+	# two-sided p-value (densities no larger than the observed one, with R's relative tolerance):
+	d = dnhyper(1.0)
+	pvalue = min(1.0, d[d <= d[x - lo] * (1 + 1e-7)].sum())
+
+	# conditional maximum likelihood estimate of the odds ratio:
+	if x == lo:
+		odds = 0.0
+	elif x == hi:
+		odds = float("inf")
+	else:
+		mu = mnhyper(1.0)
+		if mu > x:
+			odds = zeroin(lambda t: mnhyper(t) - x, 0, 1)
+		elif mu < x:
+			odds = 1 / zeroin(lambda t: mnhyper(1 / t) - x, numpy.finfo(float).eps, 1)
+		else:
+			odds = 1.0
+	return float(odds), float(pvalue)
+
+
+""" define a function to extend the shared table of log factorials to (at least) a given size... """
+def logFactorialTable(size):
+	global logFactorials
+	if len(logFactorials) <= size:
+		logFactorials = numpy.array([ math.lgamma(value + 1.0) for value in range(0, size + 1) ])
+	return logFactorials
+
+
+""" define a function to compute log binomial coefficients from the shared table of log factorials... """
+def lchoose(n, k):
+	table = logFactorialTable(int(numpy.max(n)))
+	return table[n] - table[k] - table[numpy.subtract(n, k)]
+
+
+""" define a function to compute the hypergeometric densities of a batch of 2x2 table margins... """
+def marginDensities(m, n, k):
+
+	"""
+	m, n, k	:	Arrays of table margins (first column total, second column total and first row total).
+
+	Returns the lower support bounds, the support offsets (0 ... S-1) and the normalized log densities of every margin
+	over its support, padded with -inf beyond the upper bound.
+	"""
+
+	lo, hi = numpy.maximum(0, k - n), numpy.minimum(k, m)
+	offsets = numpy.arange(0, int((hi - lo).max()) + 1 if len(lo) else 1)
+	support = lo[:, None] + offsets[None, :]
+	valid = support <= hi[:, None]
+	support = numpy.where(valid, support, lo[:, None])
+
+	logd = lchoose(m[:, None], support) + lchoose(n[:, None], k[:, None] - support)
+	logd = numpy.where(valid, logd, -numpy.inf)
+	return lo, offsets, logd - logSum(logd)[:, None]
+
+
+""" define a function to sum probabilities on the log scale along the last axis... """
+def logSum(logd):
+	top = logd.max(axis=-1)
+	top = numpy.where(numpy.isfinite(top), top, 0.0)
+	return top + numpy.log(numpy.exp(logd - top[..., None]).sum(axis=-1))
+
+
+""" define a function to compute the p-values of every support point of a batch of margins... """
+def marginPvalues(logd, alternative="two.sided"):
+
+	"""
+	logd	:	Normalized log densities of every margin over its support (from marginDensities).
+	alternative:	Alternative hypothesis ("two.sided", "greater" or "less").
+
+	Returns the log p-values of every support point (as R's fisher.test, under an odds ratio of 1).
+	"""
+
+	with numpy.errstate(invalid="ignore", divide="ignore"):
+		if alternative == "greater":
+			return numpy.logaddexp.accumulate(logd[:, ::-1], axis=1)[:, ::-1]
+		if alternative == "less":
+			return numpy.logaddexp.accumulate(logd, axis=1)
+
+		# two-sided: sum the densities no larger than the observed one (with R's relative tolerance), smallest first:
+		order = numpy.argsort(logd, axis=1, kind="mergesort")
+		ordered = numpy.take_along_axis(logd, order, axis=1)
+		threshold = numpy.where(numpy.isfinite(ordered), ordered + math.log1p(1e-7), numpy.nan)
+		count = numpy.zeros(ordered.shape, dtype=int)
+		within = numpy.ones(ordered.shape, dtype=bool)
+		for shift in range(1, ordered.shape[1]):
+			within[:, -shift:] = False
+			within[:, :-shift] &= ordered[:, shift:] <= threshold[:, :-shift]
+			if not within.any():
+				break
+			count += within
+		cumulative = numpy.logaddexp.accumulate(ordered, axis=1)
+		logp = numpy.empty(ordered.shape)
+		numpy.put_along_axis(logp, order, numpy.take_along_axis(cumulative, numpy.arange(ordered.shape[1])[None, :] + count, axis=1), axis=1)
+		return logp
+
+
+""" define a function to estimate the conditional maximum likelihood odds ratios of a batch of 2x2 tables... """
+def conditionalOdds(logd, lo, x, start=None, iterations=100):
+
+	"""
+	logd	:	Normalized log densities over the support of each table's margins (from marginDensities).
+	lo		:	Lower support bound of each table.
+	x		:	Observed in_both count of each table.
+	start	:	Initial log odds ratio of each table (e.g. the log sample odds ratio).
+	iterations:	Maximum number of Newton steps.
+
+	Solves E[in_both | odds ratio] = x for every table by safeguarded Newton steps on the log odds ratio (the mean is
+	increasing in it, with the variance as slope); tables at the support bounds get 0 or Inf, as in R.
+	"""
+
+	offsets = numpy.arange(0, logd.shape[1])[None, :]
+	target = (x - lo).astype(float)
+	upper = (numpy.isfinite(logd) * offsets).max(axis=1)
+	odds = numpy.where(target == 0, 0.0, numpy.inf)
+
+	interior = numpy.nonzero((target > 0) & (target < upper))[0]
+	logd, target = logd[interior], target[interior]
+	theta = numpy.zeros(len(interior)) if start is None else numpy.asarray(start, dtype=float)[interior]
+	bounds = numpy.array([-numpy.inf, numpy.inf]) * numpy.ones((len(interior), 1))
+	active = numpy.arange(0, len(interior))
+
+	for iteration in range(0, iterations):
+		if not len(active):
+			break
+		weights = logd[active] + theta[active, None] * offsets
+		weights = numpy.exp(weights - weights.max(axis=1)[:, None])
+		weights /= weights.sum(axis=1)[:, None]
+		mean = (weights * offsets).sum(axis=1)
+		variance = (weights * (offsets - mean[:, None]) ** 2).sum(axis=1)
+		error = mean - target[active]
+
+		# keep a bracket around the root, and fall back to bisection (or a bounded step) when Newton leaves it:
+		bounds[active, 1] = numpy.where(error > 0, theta[active], bounds[active, 1])
+		bounds[active, 0] = numpy.where(error < 0, theta[active], bounds[active, 0])
+		low, high = bounds[active, 0], bounds[active, 1]
+		with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+			step = theta[active] - error / variance
+			fallback = numpy.where(numpy.isinf(low), high - 4.0, numpy.where(numpy.isinf(high), low + 4.0, (low + high) / 2))
+		step = numpy.where((step > low) & (step < high), step, fallback)
+
+		done = (numpy.abs(step - theta[active]) <= 1e-12 * (1 + numpy.abs(theta[active]))) | (error == 0)
+		theta[active] = numpy.where(error == 0, theta[active], step)
+		active = active[~done]
+
+	odds[interior] = numpy.exp(theta)
+	return odds
+
+
+""" define a function to run Fisher's exact test on a whole grid of 2x2 tables at once... """
+def fisherGrid(inBoth, inOne, inTwo, neither, alternative="two.sided", logp="OFF", estimate="ON", batch=2 ** 22):
+
+	"""
+	inBoth	:	Array of genes in both sets.
+	inOne	:	Array of genes in the first set only.
+	inTwo	:	Array of genes in the second set only.
+	neither	:	Array of genes in neither set.
+	alternative:	Alternative hypothesis ("two.sided", "greater" or "less"); the one-sided tests are cumulative tails.
+	logp	:	Return natural log p-values (no underflow for very small p-values)?
+	estimate:	Estimate the conditional MLE odds ratios (NaN otherwise, which skips the root finding)?
+	batch	:	Maximum number of support points held in memory at once.
+
+	Tables sharing their margins share one set of densities and p-values (so only the distinct margins of the grid
+	are computed, in batches), and the log factorials come from a single table sized to the grid. Against R's
+	fisher.test, p-values agree to about 1e-9 (relative; R's dhyper uses a different but equally accurate
+	algorithm) and odds ratios to R's uniroot tolerance (about 1.2e-4 on the odds ratio below 1 and on its inverse
+	above 1); fisherTest reproduces R's root search itself.
+
+	Returns the odds ratio and p-value arrays, shaped like the input.
+	"""
+
+	if alternative not in ["two.sided", "greater", "less"]:
+		sys.exit("Error: choose a valid alternative")
+	shape = numpy.shape(inBoth)
+	x = numpy.ravel(inBoth).astype(int)
+	m = x + numpy.ravel(inTwo).astype(int)
+	n = numpy.ravel(inOne).astype(int) + numpy.ravel(neither).astype(int)
+	k = x + numpy.ravel(inOne).astype(int)
+	logFactorialTable(int((m + n).max()) if len(m) else 0)
+
+	# the (continuity corrected) log sample odds ratios start the odds ratio estimates:
+	sample = numpy.log((x + 0.5) * (n - k + x + 0.5) / ((k - x + 0.5) * (m - x + 0.5)))
+
+	# distinct margins, in batches of (about) the given number of support points:
+	margins, inverse = numpy.unique(numpy.stack([m, n, k], axis=1), axis=0, return_inverse=True)
+	inverse = numpy.ravel(inverse)
+	width = numpy.minimum(margins[:, 0], margins[:, 2]) + 1
+	odds, logp_ = numpy.empty(len(x)), numpy.empty(len(x))
+	start = 0
+	while start < len(margins):
+		stop = start + max(1, batch // int(width[start:].max()))
+		lo, offsets, logd = marginDensities(margins[start:stop, 0], margins[start:stop, 1], margins[start:stop, 2])
+		pvalues = marginPvalues(logd, alternative=alternative)
+
+		cells = numpy.nonzero((inverse >= start) & (inverse < stop))[0]
+		rows = inverse[cells] - start
+		logp_[cells] = pvalues[rows, x[cells] - lo[rows]]
+		if estimate == "ON":
+			odds[cells] = conditionalOdds(logd[rows], lo[rows], x[cells], start=sample[cells])
+		else:
+			odds[cells] = numpy.nan
+		start = stop
+
+	logp_ = numpy.minimum(logp_, 0.0)
+	pvalues = logp_ if logp == "ON" else numpy.exp(logp_)
+	return odds.reshape(shape), pvalues.reshape(shape)
+
+
+""" define a function to find the degree of overlap between two ranked gene signatures... """
+def compareOverlap(geneset1, geneset2, background, granularity=10, alternative="two.sided", logp="OFF", exact="OFF", plot="OFF", colors=overlapColors):
+
+	"""
+	geneset1:	Ranked genes of the first signature (rows).
+	geneset2:	Ranked genes of the second signature (columns).
+	background:	Background gene list, its GeneIndex (for gene ID signatures) or its length.
+	granularity:	Number of genes added to each prefix at every step.
+	alternative:	Alternative hypothesis ("two.sided", "greater" or "less").
+	logp	:	Return natural log p-values?
+	exact	:	Test every cell with fisherTest, reproducing R's odds ratio root search (two-sided only; slow)?
+	plot	:	Path to an odds ratio contour plot (as the filled.contour of mapOverlap.r).
+	colors	:	Colors of the plot color ramp.
+
+	Returns a dictionary with the odds ratio ("ODDS") and p-value ("PVAL") matrices.
+	"""
+
+	total = background if isinstance(background, int) else len(background)
+	inBoth, inOne, inTwo, neither = overlapCounts(geneset1, geneset2, total, granularity=granularity)
+
+	if exact == "ON":
+		odds, pvalues = numpy.zeros(inBoth.shape), numpy.zeros(inBoth.shape)
+		for k, l in numpy.ndindex(*inBoth.shape):
+			odds[k, l], pvalues[k, l] = fisherTest(int(inBoth[k, l]), int(inOne[k, l]), int(inTwo[k, l]), int(neither[k, l]))
+		if logp == "ON":
+			pvalues = numpy.log(pvalues)
+	else:
+		odds, pvalues = fisherGrid(inBoth, inOne, inTwo, neither, alternative=alternative, logp=logp)
+
+	if plot != "OFF":
+		plotOverlap(odds, plot, colors=colors)
+	return { "ODDS": odds, "PVAL": pvalues }
+
+
+""" define a function to copy a NumPy array into shared memory (inherited by pool workers, not pickled)... """
+def sharedArray(array, typecode="d"):
+	shared = multiprocessing.RawArray(typecode, max(1, int(array.size)))
+	numpy.frombuffer(shared, dtype=numpy.float64 if typecode == "d" else numpy.int32)[:array.size] = array.ravel()
+	return (shared, typecode, array.shape)
+
+
+""" define a function to set up a permutation worker from the shared arrays... """
+def startPermutations(arrays, options):
+	for name, (shared, typecode, shape) in arrays.items():
+		size = int(numpy.prod(shape))
+		permutationState[name] = numpy.frombuffer(shared, dtype=numpy.float64 if typecode == "d" else numpy.int32)[:size].reshape(shape)
+	permutationState.update(options)
+
+
+""" define a function to run a block of permutations in a worker... """
+def permutationTask(task):
+
+	"""
+	task	:	First and last (excluded) permutation numbers; permutation i always uses the seed (seed, i).
+
+	Returns the permutation numbers, the minimum log p-value of each permuted grid and, for every observed cell, the
+	number of permuted cells at least as significant (summed over the block).
+	"""
+
+	start, stop = task
+	state = permutationState
+	K, L, granularity = state["K"], state["L"], state["granularity"]
+	rank1, lo, table, observed = state["rank1"], state["lo"], state["table"], state["observed"]
+	positions, cells = numpy.arange(0, state["size"]), numpy.arange(0, K * L)
+
+	minima, exceed = numpy.empty(stop - start), numpy.zeros(K * L, dtype=numpy.int64)
+	for index, permutation in enumerate(range(start, stop)):
+
+		# draw a random ranked list from the background and look up the p-values of its 2x2 tables:
+		sample = numpy.random.RandomState([state["seed"], permutation]).permutation(len(rank1))[:state["size"]]
+		inBoth = sharedCounts(rank1[sample], positions, K, L, granularity).ravel()
+		logp = table[cells, inBoth - lo]
+
+		# keep only the grid minimum and the exceedance counts (memory does not grow with the permutations):
+		minima[index] = logp.min()
+		exceed += numpy.searchsorted(numpy.sort(logp), observed + tieTolerance, side="right")
+	return start, stop, minima, exceed
+
+
+""" define a function to assess an overlap map against a permutation null... """
+def permuteOverlap(geneset1, geneset2, background, granularity=10, permutations=1000, processes=None, alternative="two.sided", seed=0, chunk=None):
+
+	"""
+	geneset1:	Ranked genes of the first signature (rows; kept fixed).
+	geneset2:	Ranked genes of the second signature (columns; replaced by random background lists of the same length).
+	background:	Background gene list, or its GeneIndex (for gene ID signatures).
+	granularity:	Number of genes added to each prefix at every step.
+	permutations:	Number of permutations.
+	processes:	Number of worker processes (defaults to the number of cores; 1 runs in this process).
+	alternative:	Alternative hypothesis of the Fisher tests ("two.sided", "greater" or "less").
+	seed	:	Random seed (results do not depend on the number of processes).
+	chunk	:	Permutations per task (defaults to a few tasks per worker).
+
+	The p-value of every possible 2x2 table of the grid is tabulated once (the margins do not change between
+	permutations) and shared with the workers together with the background ranks, so each permutation only costs a
+	rank histogram and a table lookup. Each worker streams back the minimum p-value of every permuted grid and the
+	per-cell exceedance counts, from which the max-statistic (FWER) and empirical FDR adjusted p-values are derived.
+
+	Returns a dictionary with the odds ratio ("ODDS"), p-value ("PVAL"), FWER ("FWER") and FDR ("FDR") matrices, and
+	the minimum p-value of every permutation ("NULL", empty if the grid is).
+	"""
+
+	total = len(background)
+	K, L = len(geneset1) // granularity, len(geneset2) // granularity
+	if len(geneset2) > total:
+		sys.exit("Error: the second signature is longer than the background list")
+
+	# observed grid:
+	inBoth, inOne, inTwo, neither = overlapCounts(geneset1, geneset2, total, granularity=granularity)
+	odds, observed = fisherGrid(inBoth, inOne, inTwo, neither, alternative=alternative, logp="ON")
+
+	# a signature shorter than the granularity leaves an empty grid (as in compareOverlap), with nothing to permute:
+	if K == 0 or L == 0:
+		empty = numpy.zeros((K, L))
+		return { "ODDS": odds, "PVAL": empty, "FWER": empty.copy(), "FDR": empty.copy(), "NULL": numpy.zeros(0) }
+
+	# ranks of the background genes in the first signature, and the p-values of every table of the permuted grids:
+	codes1, codesBackground = geneCodes(geneset1, numpy.arange(0, total, dtype=numpy.int32) if isinstance(background, GeneIndex) else background)
+	rank1, first = firstRanks(codes1, int(max(codes1.max() + 1 if len(codes1) else 0, codesBackground.max() + 1 if total else 0)))
+	rank1 = rank1[codesBackground]
+	size1, size2 = prefixSizes(first, K, granularity), granularity * numpy.arange(1, L + 1)
+	m, k = numpy.tile(size2, K), numpy.repeat(size1, L)
+	lo, offsets, logd = marginDensities(m, total - m, k)
+	table = marginPvalues(logd, alternative=alternative)
+
+	arrays = { "rank1": sharedArray(rank1, "i"), "lo": sharedArray(lo, "i"), "table": sharedArray(table), "observed": sharedArray(observed.ravel()) }
+	options = { "K": K, "L": L, "granularity": granularity, "size": len(geneset2), "seed": seed }
+	processes = processes or multiprocessing.cpu_count()
+	chunk = chunk or max(1, int(math.ceil(float(permutations) / (4 * processes))))
+	tasks = [ (start, min(start + chunk, permutations)) for start in range(0, permutations, chunk) ]
+
+	# run the permutations, accumulating the streamed results:
+	minima, exceed = numpy.empty(permutations), numpy.zeros(K * L, dtype=numpy.int64)
+	if processes == 1:
+		startPermutations(arrays, options)
+		results, pool = map(permutationTask, tasks), None
+	else:
+		pool = multiprocessing.Pool(min(processes, len(tasks)), initializer=startPermutations, initargs=(arrays, options))
+		results = pool.imap_unordered(permutationTask, tasks)
+	try:
+		for start, stop, taskMinima, taskExceed in results:
+			minima[start:stop] = taskMinima
+			exceed += taskExceed
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	# max-statistic FWER: the share of permuted grids whose best cell beats the observed cell:
+	observed = observed.ravel()
+	beaten = numpy.searchsorted(numpy.sort(minima), observed + tieTolerance, side="right")
+	fwer = (1.0 + beaten) / (permutations + 1.0)
+
+	# empirical FDR: expected permuted cells over observed cells at least as significant, made monotone:
+	called = numpy.searchsorted(numpy.sort(observed), observed + tieTolerance, side="right")
+	fdr = numpy.minimum(1.0, (exceed + 1.0) / (permutations + 1.0) / called)
+	order = numpy.argsort(-observed, kind="mergesort")
+	fdr[order] = numpy.minimum.accumulate(fdr[order])
+
+	return { "ODDS": odds, "PVAL": numpy.exp(observed).reshape(K, L), "FWER": fwer.reshape(K, L), "FDR": fdr.reshape(K, L), "NULL": numpy.exp(minima) }
+
+
+""" define a function to plot an odds ratio matrix as a filled contour... """
+def plotOverlap(odds, outfile, colors=overlapColors, levels=20):
+
+	"""
+	odds	:	Odds ratio matrix (rows: first signature, columns: second signature).
+	outfile	:	Path to the plot image.
+	colors	:	Colors of the color ramp.
+	levels	:	Number of contour levels.
+	"""
+
+	import matplotlib
+	matplotlib.use("Agg")
+	from matplotlib import pyplot
+	from matplotlib.colors import LinearSegmentedColormap
+
+	finite = odds[numpy.isfinite(odds)]
+	top = finite.max() if finite.size and finite.max() > 0 else 1.0
+	x, y = numpy.linspace(0, 1, odds.shape[0]), numpy.linspace(0, 1, odds.shape[1])
+	figure = pyplot.figure()
+	contour = pyplot.contourf(x, y, numpy.minimum(odds, top).T, levels=numpy.linspace(0, top, levels + 1), cmap=LinearSegmentedColormap.from_list("mapOverlap", colors))
+	pyplot.colorbar(contour)
+	pyplot.title("Odds Ratio of Enrichment")
+	figure.savefig(outfile)
+	pyplot.close(figure)
+
+
+""" define a function to write a matrix as a tab-delimited table... """
+def writeMatrix(matrix, outfile):
+	outhandle = open(outfile, "w")
+	for row in matrix:
+		print("\t".join([ repr(float(value)) for value in row ]), file=outhandle)
+	outhandle.close()
+
+
+""" define the command-line interface... """
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Find the degree of overlap between two ranked gene signatures.")
+	parser.add_argument("geneset1", help="First signature table (rows of the output matrices).")
+	parser.add_argument("geneset2", help="Second signature table (columns of the output matrices).")
+	parser.add_argument("background", help="Background gene list.")
+	parser.add_argument("--granularity", type=int, default=10, help="Number of genes added to each prefix at every step.")
+	parser.add_argument("--output", default="mapOverlap", help="Output prefix for the ODDS and PVAL tables.")
+	parser.add_argument("--alternative", default="two.sided", choices=["two.sided", "greater", "less"], help="Alternative hypothesis of the Fisher tests.")
+	parser.add_argument("--logp", action="store_true", help="Write natural log p-values.")
+	parser.add_argument("--exact", action="store_true", help="Reproduce R's odds ratio root search cell by cell (slow).")
+	parser.add_argument("--plot", default="OFF", help="Path to an odds ratio contour plot.")
+	parser.add_argument("--permutations", type=int, default=0, help="Number of permutations for the FWER and FDR tables (0: none).")
+	parser.add_argument("--processes", type=int, default=None, help="Number of permutation worker processes (default: number of cores).")
+	parser.add_argument("--seed", type=int, default=0, help="Permutation random seed.")
+	options = parser.parse_args(arguments)
+
+	background = openGeneIndex(options.background)
+	geneset1, geneset2 = readSignature(options.geneset1, index=background), readSignature(options.geneset2, index=background)
+	if options.permutations:
+		overlap = permuteOverlap(geneset1, geneset2, background, granularity=options.granularity, permutations=options.permutations, processes=options.processes, alternative=options.alternative, seed=options.seed)
+		if options.logp:
+			overlap["PVAL"] = numpy.log(overlap["PVAL"])
+		if options.plot != "OFF":
+			plotOverlap(overlap["ODDS"], options.plot)
+	else:
+		overlap = compareOverlap(geneset1, geneset2, background, granularity=options.granularity, alternative=options.alternative, logp="ON" if options.logp else "OFF", exact="ON" if options.exact else "OFF", plot=options.plot)
+	for name in ["ODDS", "PVAL", "FWER", "FDR"]:
+		if name in overlap:
+			writeMatrix(overlap[name], "%s_%s.txt" % (options.output, name))
+	print("Signatures: %s x %s genes, background: %s genes, grid: %s x %s" % (len(geneset1), len(geneset2), len(background), overlap["ODDS"].shape[0], overlap["ODDS"].shape[1]))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# This is a script that screens a directory of ranked gene signatures (limma tables) for significant pairwise overlaps.
+# Note: 	Every signature is read once (as gene IDs of the background list's GeneIndex) and each of its top-k prefixes is
+#			packed into a bitset over the background gene universe (genes outside the background list are dropped), so
+#			the overlap of any two prefixes is the popcount of a bitwise AND: the cost grows with pairs x prefixes x
+#			genes / 64 words. All 2x2 tables are then tested at once (mapOverlap.fisherGrid), and signature pairs are
+#			ranked by their most significant prefix combination.
+# Usage: 	python mapScreen.py data/ data/Background_List.txt --prefixes 25,50,100,200 --top 50 --output screen.txt
+#
+#			From Python:
+#
+#			import mapScreen
+#			pairs = mapScreen.screenOverlap("data/", "data/Background_List.txt", prefixes=[25, 50, 100, 200])
+
+from __future__ import print_function
+import os, sys, glob, argparse, collections
+import numpy
+
+from mapOverlap import GeneIndex, openGeneIndex, indexRecords, readSignature, fisherGrid
+
+""" define the default prefix sizes """
+screenPrefixes = [25, 50, 100, 200]
+
+""" define the number of set bits of every byte (for NumPy versions without bitwise_count) """
+byteCounts = numpy.array([ bin(value).count("1") for value in range(0, 256) ], dtype=numpy.uint8)
+
+
+""" define a function to load a set of signatures once... """
+def loadSignatures(signatures, pattern="*.csv", index=None):
+
+	"""
+	signatures:	Directory of signature tables, glob pattern or list of paths.
+	pattern	:	File pattern used within a directory.
+	index	:	GeneIndex to convert the genes to.
+
+	Returns an ordered dictionary of signature name (file name without extension) and ranked genes (gene IDs if an
+	index is given).
+	"""
+
+	if isinstance(signatures, str) and os.path.isdir(signatures):
+		paths = sorted(glob.glob(os.path.join(signatures, pattern)))
+	elif isinstance(signatures, str):
+		paths = sorted(glob.glob(signatures))
+	else:
+		paths = list(signatures)
+	return collections.OrderedDict((os.path.splitext(os.path.basename(path))[0], readSignature(path, index=index)) for path in paths)
+
+
+""" define a function to count the set bits of packed bitsets... """
+def popcount(words):
+
+	"""
+	words	:	Array of uint64 bitset words.
+
+	Returns the number of set bits, summed over the last (word) axis.
+	"""
+
+	if hasattr(numpy, "bitwise_count"):
+		return numpy.bitwise_count(words).sum(axis=-1, dtype=numpy.int64)
+	return byteCounts[words.view(numpy.uint8)].sum(axis=-1, dtype=numpy.int64)
+
+
+""" define a function to pack the top-k prefixes of a signature into bitsets over the gene universe... """
+def prefixBits(genes, count, prefixes):
+
+	"""
+	genes	:	Ranked gene IDs of the signature.
+	count	:	Number of background genes (IDs from count on are outside the universe and dropped).
+	prefixes:	Prefix sizes (a prefix longer than the signature is the whole signature).
+
+	Returns a (prefixes x words) uint64 array.
+	"""
+
+	words = numpy.zeros((len(prefixes), (count + 63) // 64), dtype=numpy.uint64)
+	ranks = numpy.nonzero(genes < count)[0]
+	for index, prefix in enumerate(prefixes):
+		positions = genes[ranks[ranks < prefix]].astype(numpy.int64)
+		numpy.bitwise_or.at(words[index], positions >> 6, numpy.left_shift(numpy.uint64(1), (positions & 63).astype(numpy.uint64)))
+	return words
+
+
+""" define a function to screen all signature pairs for significant overlaps... """
+def screenOverlap(signatures, background, prefixes=screenPrefixes, top=50, alternative="two.sided", best="ON", block=64):
+
+	"""
+	signatures:	Directory of signature tables, glob pattern, list of paths or dictionary of name and ranked genes (or IDs).
+	background:	Path to the background list (its gene index is opened or built), GeneIndex or background gene list.
+	prefixes:	Prefix sizes compared between every two signatures (every combination of them).
+	top		:	Number of rows returned (None for all).
+	alternative:	Alternative hypothesis of the Fisher tests ("two.sided", "greater" or "less").
+	best	:	Keep only the most significant prefix combination of each signature pair?
+	block	:	Number of signatures intersected with another one at once (bounds memory).
+
+	Returns a list of result dictionaries (signature1, signature2, prefix1, prefix2, in_both, size1, size2, odds,
+	pvalue), most significant first.
+	"""
+
+	if isinstance(background, str):
+		index = openGeneIndex(background)
+	else:
+		index = background if isinstance(background, GeneIndex) else GeneIndex(indexRecords(background))
+	if not isinstance(signatures, dict):
+		signatures = loadSignatures(signatures, index=index)
+	names, total = list(signatures.keys()), len(index)
+
+	# pack every prefix of every signature once (as gene IDs), and count its genes:
+	genes = [ numpy.asarray(signatures[name]) for name in names ]
+	genes = [ values if values.dtype.kind in "iu" else index.lookup(values) for values in genes ]
+	bits = numpy.array([ prefixBits(values, total, prefixes) for values in genes ]).reshape(len(names), len(prefixes), -1)
+	sizes = popcount(bits)
+
+	# overlap counts of every pair of prefixes of every pair of signatures (blocks of second signatures at a time):
+	cells = list()
+	for first in range(0, len(names) - 1):
+		for start in range(first + 1, len(names), block):
+			stop = min(start + block, len(names))
+			inBoth = popcount(bits[first][None, :, None, :] & bits[start:stop, None, :, :])
+			second, prefix1, prefix2 = numpy.indices(inBoth.shape).reshape(3, -1)
+			cells.append(numpy.stack([numpy.repeat(first, inBoth.size), start + second, prefix1, prefix2, inBoth.ravel()], axis=1))
+	if not cells:
+		return list()
+	cells = numpy.concatenate(cells)
+	first, second, prefix1, prefix2, inBoth = cells.T
+	size1, size2 = sizes[first, prefix1], sizes[second, prefix2]
+
+	# test all tables at once, and rank them (pairs by their best prefix combination):
+	odds, logp = fisherGrid(inBoth, size1 - inBoth, size2 - inBoth, total - size1 - size2 + inBoth, alternative=alternative, logp="ON")
+	order = numpy.lexsort((-odds, logp))
+	if best == "ON":
+		pair = first[order] * len(names) + second[order]
+		order = order[numpy.sort(numpy.unique(pair, return_index=True)[1])]
+	if top is not None:
+		order = order[:top]
+
+	rows = list()
+	for index in order:
+		rows.append(collections.OrderedDict([("signature1", names[first[index]]), ("signature2", names[second[index]]), ("prefix1", prefixes[prefix1[index]]), ("prefix2", prefixes[prefix2[index]]), ("in_both", int(inBoth[index])), ("size1", int(size1[index])), ("size2", int(size2[index])), ("odds", float(odds[index])), ("pvalue", float(numpy.exp(logp[index])))]))
+	return rows
+
+
+""" define the command-line interface... """
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Screen a set of ranked gene signatures for significant pairwise overlaps.")
+	parser.add_argument("signatures", help="Directory of signature tables (or a quoted glob pattern).")
+	parser.add_argument("background", help="Background gene list.")
+	parser.add_argument("--pattern", default="*.csv", help="Signature file pattern within the directory.")
+	parser.add_argument("--prefixes", default=",".join(map(str, screenPrefixes)), help="Comma-separated prefix sizes.")
+	parser.add_argument("--top", type=int, default=50, help="Number of rows to report (0: all).")
+	parser.add_argument("--alternative", default="two.sided", choices=["two.sided", "greater", "less"], help="Alternative hypothesis of the Fisher tests.")
+	parser.add_argument("--all", action="store_true", help="Report every prefix combination, not only the best one of each pair.")
+	parser.add_argument("--output", default="OFF", help="Path to a tab-delimited results table (default: print).")
+	options = parser.parse_args(arguments)
+
+	index = openGeneIndex(options.background)
+	signatures = loadSignatures(options.signatures, pattern=options.pattern, index=index)
+	prefixes = [ int(prefix) for prefix in options.prefixes.split(",") ]
+	rows = screenOverlap(signatures, index, prefixes=prefixes, top=options.top or None, alternative=options.alternative, best="OFF" if options.all else "ON")
+
+	outhandle = sys.stdout if options.output == "OFF" else open(options.output, "w")
+	columns = ["signature1", "signature2", "prefix1", "prefix2", "in_both", "size1", "size2", "odds", "pvalue"]
+	print("\t".join(columns), file=outhandle)
+	for row in rows:
+		print("\t".join([ str(row[column]) for column in columns ]), file=outhandle)
+	if outhandle is not sys.stdout:
+		outhandle.close()
+	print("Signatures: %s, prefixes: %s, pairs: %s" % (len(signatures), len(prefixes), len(signatures) * (len(signatures) - 1) // 2), file=sys.stderr)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())